@@ -0,0 +1,71 @@
+"""
+Density-matrix backend: h on every qubit, then a cx ladder, with 1%
+depolarizing noise after every gate. The kernel backend is timed against
+multiplying vec(rho) by the full 4^n x 4^n superoperator of each gate and
+channel, up to the size where that still fits in memory, and the two states
+are compared.
+
+    python benchmarks/density.py [num_qubits ...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from qsm import NoiseModel, QuantumCircuit, depolarizing, hadamard
+from qsm.kernels import apply_multi_qubit_gate
+
+CX = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=np.complex128)
+NAIVE_MAX_QUBITS = 6
+
+
+def layers(num_qubits):
+    return [("h", [qubit]) for qubit in range(num_qubits)] + [("cx", [qubit, qubit + 1]) for qubit in range(num_qubits - 1)]
+
+
+def evolve(num_qubits, probability):
+    noise_model = NoiseModel()
+    noise_model.add_gate_error(depolarizing(probability))
+    circuit = QuantumCircuit(num_qubits, noise_model=noise_model)
+    for name, qubits in layers(num_qubits):
+        getattr(circuit, name)(*qubits)
+    return circuit.qubits.state
+
+
+def full(num_qubits, matrix, qubits):
+    # Rows of the identity are basis states, so the gate applied to each row gives U^T
+    return apply_multi_qubit_gate(np.eye(2 ** num_qubits, dtype=np.complex128), matrix, qubits).T
+
+
+def superoperator(operators):
+    return sum(np.kron(operator, operator.conj()) for operator in operators)
+
+
+def naive(num_qubits, probability):
+    vector = np.zeros(4 ** num_qubits, dtype=np.complex128)
+    vector[0] = 1
+    for name, qubits in layers(num_qubits):
+        gate = full(num_qubits, hadamard() if name == "h" else CX, qubits)
+        vector = superoperator([gate]) @ vector
+        for qubit in qubits:
+            vector = superoperator([full(num_qubits, kraus, [qubit]) for kraus in depolarizing(probability)]) @ vector
+    return vector.reshape(2 ** num_qubits, 2 ** num_qubits)
+
+
+def main(sizes, probability=0.01):
+    print("{:>7} {:>11} {:>11}".format("qubits", "kernels s", "naive s"))
+    for num_qubits in sizes:
+        start = time.perf_counter()
+        rho = evolve(num_qubits, probability)
+        elapsed = time.perf_counter() - start
+        naive_time = "-"
+        if num_qubits <= NAIVE_MAX_QUBITS:
+            start = time.perf_counter()
+            reference = naive(num_qubits, probability)
+            naive_time = "{:.3f}".format(time.perf_counter() - start)
+            assert np.allclose(np.asarray(rho).reshape(reference.shape), reference)
+        print("{:>7} {:>11.3f} {:>11}".format(num_qubits, elapsed, naive_time))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [4, 5, 6, 9, 12])
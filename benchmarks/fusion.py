@@ -0,0 +1,48 @@
+"""
+Gate fusion: a layered rotation circuit (rx, ry and rz on every qubit, then a
+cx chain, per layer) compiled and run at each fusion width. Width 0 disables
+the pass; the state of every width is checked against width 0.
+
+    python benchmarks/fusion.py [num_qubits] [layers]
+"""
+import sys
+import time
+
+import numpy as np
+
+from qsm import QuantumCircuit
+
+
+def layered(num_qubits, layers):
+    rng = np.random.default_rng(0)
+    circuit = QuantumCircuit(num_qubits, lazy=True, backend="statevector")
+    for _ in range(layers):
+        for qubit in range(num_qubits):
+            circuit.rx(qubit, rng.uniform(0, 2 * np.pi))
+            circuit.ry(qubit, rng.uniform(0, 2 * np.pi))
+            circuit.rz(qubit, rng.uniform(0, 2 * np.pi))
+        for qubit in range(num_qubits - 1):
+            circuit.cx(qubit, qubit + 1)
+    return circuit
+
+
+def main(num_qubits=20, layers=4, widths=(0, 1, 2, 3)):
+    circuit = layered(num_qubits, layers)
+    print("{} qubits, {} gates".format(num_qubits, len(circuit.instructions)))
+    print("{:>6} {:>7} {:>7} {:>11} {:>9}".format("width", "steps", "fused", "compile s", "run s"))
+    reference = None
+    for width in widths:
+        start = time.perf_counter()
+        plan = circuit.compile(width)
+        compiled = time.perf_counter()
+        circuit.run(width)
+        ran = time.perf_counter()
+        state = np.array(circuit.qubits.state)
+        if reference is None:
+            reference = state
+        assert np.allclose(state, reference)
+        print("{:>6} {:>7} {:>7} {:>11.3f} {:>9.3f}".format(width, len(plan), plan.num_fused, compiled - start, ran - compiled))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
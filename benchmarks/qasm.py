@@ -0,0 +1,59 @@
+"""
+OpenQASM 2 reader and writer: a random program of single- and two-qubit gates
+(with parameter expressions) is generated to a file, read back with
+QuantumCircuit.from_qasm and written again with to_qasm, and both are timed in
+gates per second.
+
+    python benchmarks/qasm.py [num_gates] [num_qubits]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from qsm import QuantumCircuit
+
+SINGLE = ["h", "x", "t", "sdg", "rz(pi/4)", "rx(0.25)", "u3(0.1,0.2,0.3)", "u1(pi/8)"]
+DOUBLE = ["cx", "cz", "swap", "cu1(pi/2)"]
+
+
+def write_program(path, num_gates, num_qubits):
+    rng = np.random.default_rng(0)
+    kinds = rng.integers(len(SINGLE) + len(DOUBLE), size=num_gates)
+    qubits = rng.integers(num_qubits, size=(num_gates, 2))
+    with open(path, "w") as handle:
+        handle.write('OPENQASM 2.0;\ninclude "qelib1.inc";\nqreg q[{}];\n'.format(num_qubits))
+        for kind, (first, second) in zip(kinds, qubits):
+            if kind < len(SINGLE):
+                handle.write("{} q[{}];\n".format(SINGLE[kind], first))
+            else:
+                if second == first:
+                    second = (first + 1) % num_qubits
+                handle.write("{} q[{}],q[{}];\n".format(DOUBLE[kind - len(SINGLE)], first, second))
+
+
+def main(num_gates=1000000, num_qubits=20):
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.qasm")
+        target = os.path.join(directory, "target.qasm")
+        write_program(source, num_gates, num_qubits)
+        print("{} gates on {} qubits, {:.1f} MB".format(num_gates, num_qubits, os.path.getsize(source) / 1e6))
+
+        start = time.perf_counter()
+        circuit = QuantumCircuit.from_qasm(source)
+        elapsed = time.perf_counter() - start
+        assert len(circuit.instructions) == num_gates
+        print("read  {:>7.2f} s {:>9.0f} gates/s".format(elapsed, num_gates / elapsed))
+
+        start = time.perf_counter()
+        circuit.to_qasm(target)
+        elapsed = time.perf_counter() - start
+        print("write {:>7.2f} s {:>9.0f} gates/s".format(elapsed, num_gates / elapsed))
+
+        assert len(QuantumCircuit.from_qasm(target).instructions) == num_gates
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
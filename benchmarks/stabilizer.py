@@ -0,0 +1,40 @@
+"""
+GHZ states on the stabilizer tableau, where a lazy circuit of Clifford gates
+runs: building the circuit, the first measure_all (the symbolic measurement
+pass) and a second one that reuses the cached affine map.
+
+    python benchmarks/stabilizer.py [num_qubits ...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from qsm import QuantumCircuit
+
+
+def ghz(num_qubits):
+    circuit = QuantumCircuit(num_qubits, lazy=True)
+    circuit.h(0)
+    for qubit in range(num_qubits - 1):
+        circuit.cx(qubit, qubit + 1)
+    return circuit
+
+
+def main(sizes, shots=1000):
+    rng = np.random.default_rng(0)
+    print("{:>7} {:>9} {:>13} {:>13}".format("qubits", "build s", "sample s", "cached s"))
+    for num_qubits in sizes:
+        start = time.perf_counter()
+        circuit = ghz(num_qubits)
+        built = time.perf_counter()
+        counts = circuit.measure_all(shots, rng)
+        sampled = time.perf_counter()
+        circuit.measure_all(shots, rng)
+        cached = time.perf_counter()
+        assert len(counts) <= 2
+        print("{:>7} {:>9.3f} {:>13.3f} {:>13.3f}".format(num_qubits, built - start, sampled - built, cached - sampled))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [500, 1000, 2000, 4000])
@@ -0,0 +1,70 @@
+"""
+Thread scaling of the state-vector kernels: every kernel that splits the state
+into blocks (_in_blocks) is timed on one large state at 1, 2, 4 and N worker
+threads, N being the number of cores, and the speedup over one worker is
+printed next to each time.
+
+    python benchmarks/threads.py [num_qubits] [repeats]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from qsm import kernels
+
+
+def kernel_cases(num_qubits):
+    rng = np.random.default_rng(0)
+    theta = rng.uniform(0, 2 * np.pi)
+    rz = np.diag([np.exp(-0.5j * theta), np.exp(0.5j * theta)])
+    ry = np.array([[np.cos(theta / 2), -np.sin(theta / 2)], [np.sin(theta / 2), np.cos(theta / 2)]])
+    fused, _ = np.linalg.qr(rng.normal(size=(8, 8)) + 1j * rng.normal(size=(8, 8)))
+    middle = num_qubits // 2
+    last = num_qubits - 1
+    return [
+        ("single (ry)", lambda state: kernels.apply_single_qubit_gate(state, ry, middle)),
+        ("controlled (cry)", lambda state: kernels.apply_controlled_gate(state, ry, [0], last)),
+        ("cx", lambda state: kernels.apply_controlled_x(state, [middle], 0)),
+        ("swap", lambda state: kernels.apply_swap(state, 0, last)),
+        ("two-qubit", lambda state: kernels.apply_two_qubit_gate(state, np.kron(ry, ry), 1, middle)),
+        ("fused 3q", lambda state: kernels.apply_multi_qubit_gate(state, fused, [0, middle, last])),
+        ("diagonal (rz)", lambda state: kernels.apply_diagonal_gate(state, np.diagonal(rz), [middle])),
+    ]
+
+
+def thread_counts():
+    cores = os.cpu_count() or 1
+    return sorted({1, 2, 4, cores})
+
+
+def time_kernel(kernel, state, repeats):
+    kernel(state)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        kernel(state)
+    return (time.perf_counter() - start) / repeats
+
+
+def main(num_qubits=24, repeats=5):
+    state = np.zeros(2 ** num_qubits, dtype=np.complex128)
+    state[0] = 1
+    counts = thread_counts()
+    print("{} qubits, {} cores, seconds per call (speedup over 1 worker)".format(num_qubits, os.cpu_count()))
+    print("{:>18}".format("kernel") + "".join("{:>18}".format("{} workers".format(count)) for count in counts))
+    previous = kernels.get_num_threads()
+    try:
+        for name, kernel in kernel_cases(num_qubits):
+            times = []
+            for count in counts:
+                kernels.set_num_threads(count)
+                times.append(time_kernel(kernel, state, repeats))
+            cells = ["{:.4f} ({:.2f}x)".format(seconds, times[0] / seconds) for seconds in times]
+            print("{:>18}".format(name) + "".join("{:>18}".format(cell) for cell in cells))
+    finally:
+        kernels.set_num_threads(previous)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,4 +1,5 @@
 import warnings
+from itertools import islice
 
 import numpy as np
 
@@ -6,124 +7,488 @@ from qsm.qubit import *
 from qsm.gate_library import *
 from qsm.instruction import *
 from qsm.utils import *
+from qsm.results import *
+from qsm.compiler import *
+from qsm.kernels import *
+from qsm.noise import *
+from qsm.trajectories import *
+from qsm.branching import *
+from qsm.observables import *
+from qsm.gradients import *
+from qsm.qasm import *
+from qsm.circuit_file import *
+from qsm.checkpoint import *
+from qsm.backends import *
 
 warnings.filterwarnings("ignore", category=np.VisibleDeprecationWarning)
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 pi = np.pi
 
+BACKENDS = {
+    "statevector": Qubit,
+    "memmap": ChunkedQubit,
+    "mps": MatrixProductState,
+    "stabilizer": StabilizerTableau,
+    "density": DensityMatrix,
+}
+
 class QuantumCircuit:
-    def __init__(self, num_qubits):
-        self.qubits = Qubit(num_qubits)
+    """
+    With backend=None (the default) an eager circuit applies its gates to a Qubit
+    register as they are added. A lazy, unbatched one starts on the stabilizer
+    tableau instead and stays there while every gate is Clifford, so run() and
+    measure_all handle Clifford circuits of thousands of qubits. The first other
+    gate, or a request for the exact state vector, moves it to the state-vector
+    engine by replaying the recorded instructions. While a lazy circuit is on the
+    tableau, `qubits` is a StabilizerTableau, whose `state` is a read-only copy.
+
+    A noise model makes every gate record its channels after it and defaults the
+    backend to the density matrix, which is allocated when it is first used.
+
+    Mid-circuit measurements are instructions too. measure() collapses an eager
+    circuit at once and records the outcome, so a replay projects onto the same
+    outcome; in a lazy circuit the outcome is drawn at run(). `outcomes` holds the
+    measurement outcomes since the last run.
+    """
+
+    def __init__(self, num_qubits, lazy=False, batch_size=None, dtype=np.complex128, backend=None, noise_model=None):
+        self.num_qubits = num_qubits
+        self.lazy = lazy
+        self.batch_size = batch_size
+        self.noise_model = noise_model
+        self._auto = lazy and backend is None and batch_size is None and noise_model is None
+        if backend is None or isinstance(backend, str):
+            if self._auto:
+                backend = "stabilizer"
+            elif backend is None and noise_model is not None:
+                backend = "density"
+            self.qubits = BACKENDS[backend or "statevector"](num_qubits, batch_size, dtype)
+        elif backend.num_qubits != num_qubits:
+            raise ValueError("The backend holds {} qubits, not {}".format(backend.num_qubits, num_qubits))
+        else:
+            self.qubits = backend
+        self.dtype = self.qubits.dtype
+        self.instructions = []
+        self.outcomes = []
+        self._plan = None
+        self._branches = None
+        self._executed = 0
+        # The circuit's register while a caller's initial_state stands in for it
+        self._own_register = None
 
     def h(self, qubit):
-        self.customgate(qubit, hadamard())
+        self.customgate(qubit, hadamard(), "h")
 
     def cx(self, qubit_control, qubit_target):
-        self.custom_control(qubit_control, qubit_target, paulix())
+        self.custom_control(qubit_control, qubit_target, paulix(), "cx")
 
     def cy(self, qubit_control, qubit_target):
-        self.custom_control(qubit_control, qubit_target, pauliy())
+        self.custom_control(qubit_control, qubit_target, pauliy(), "cy")
 
     def cz(self, qubit_control, qubit_target):
-        self.custom_control(qubit_control, qubit_target, pauliz())
+        self.custom_control(qubit_control, qubit_target, pauliz(), "cz")
 
-    def custom_control(self, qubit_control, qubit_target, matrix):
-        gate = Controlled2By2Gate(Instruction(matrix), None)
-        self.qubits.apply_controlled_gate(gate, qubit_control, qubit_target)
+    def custom_control(self, qubit_control, qubit_target, matrix, name="custom_control", params=()):
+        controls = list(qubit_control) if np.ndim(qubit_control) else [qubit_control]
+        self.append(Instruction(matrix, name, (*controls, qubit_target), params, len(controls)))
 
     def x(self, qubit):
-        self.customgate(qubit, paulix())
+        self.customgate(qubit, paulix(), "x")
 
     def y(self, qubit):
-        self.customgate(qubit, pauliy())
+        self.customgate(qubit, pauliy(), "y")
 
     def z(self, qubit):
-        self.customgate(qubit, pauliz())
+        self.customgate(qubit, pauliz(), "z")
 
     def s(self, qubit):
-        self.customgate(qubit, s())
+        self.customgate(qubit, s(), "s")
 
     def rx(self, qubit, angle):
-        self.customgate(qubit, rx(angle))
+        self.customgate(qubit, rx(angle), "rx", (angle,))
 
     def ry(self, qubit, angle):
-        self.customgate(qubit, ry(angle))
+        self.customgate(qubit, ry(angle), "ry", (angle,))
 
     def rz(self, qubit, angle):
-        self.customgate(qubit, rz(angle))
+        self.customgate(qubit, rz(angle), "rz", (angle,))
 
     def sdg(self, qubit):
-        self.customgate(qubit, sdg())
+        self.customgate(qubit, sdg(), "sdg")
 
     def t(self, qubit):
-        self.customgate(qubit, t())
+        self.customgate(qubit, t(), "t")
 
     def tdg(self, qubit):
-        self.customgate(qubit, tdg())
+        self.customgate(qubit, tdg(), "tdg")
 
     def u3(self, theta, phi, lamba, qubit):
-        self.customgate(qubit, u(theta, phi, lamba))
+        self.customgate(qubit, u(theta, phi, lamba), "u3", (theta, phi, lamba))
 
     def u2(self, phi, lamba, qubit):
-        self.customgate(qubit, u(pi/2, phi, lamba))
+        self.customgate(qubit, u(pi/2, phi, lamba), "u2", (phi, lamba))
 
     def u1(self, lamba, qubit):
-        self.customgate(qubit, u(0, 0, lamba))
+        self.customgate(qubit, u(0, 0, lamba), "u1", (lamba,))
 
     def p(self, lamba, qubit):
-        self.customgate(qubit, phase(lamba))
+        self.customgate(qubit, phase(lamba), "p", (lamba,))
+
+    def cp(self, lamba, qubit_control, qubit_target):
+        self.custom_control(qubit_control, qubit_target, phase(lamba), "cp", (lamba,))
+
+    def ccx(self, qubit_control1, qubit_control2, qubit_target):
+        self.append(Instruction(toffoli(), "ccx", (qubit_control1, qubit_control2, qubit_target), num_controls=2))
 
     def toffolie(self, qubit_control1, qubit_control2, qubit_target):
-        self.h(qubit_target)
-        self.cx(qubit_control2, qubit_target)
-        self.tdg(qubit_target)
-        self.cx(qubit_control1, qubit_target)
-        self.t(qubit_target)
-        self.cx(qubit_control2, qubit_target)
-        self.tdg(qubit_target)
-        self.t(qubit_control2)
-        self.cx(qubit_control1, qubit_target)
-        self.t(qubit_target)
-        self.cx(qubit_control1, qubit_control2)
-        self.h(qubit_target)
-        self.tdg(qubit_control2)
-        self.t(qubit_control1)
-        self.cx(qubit_control1, qubit_control2)
+        self.ccx(qubit_control1, qubit_control2, qubit_target)
 
     def swap(self, qubit1, qubit2):
-        gate_inst = Instruction(swap())
-        gate = ControlledGate(gate_inst)
-        self.qubits.apply_controlled_gate(gate, qubit1, qubit2)
-
-    def customgate(self, qubit, matrix):
-        gate_inst = Instruction(matrix)
-        gate = SingelletonGate(gate_inst)
-        self.qubits.apply_gate(gate, qubit)
+        self.append(Instruction(swap(), "swap", (qubit1, qubit2)))
+
+    def customgate(self, qubit, matrix, name="custom", params=()):
+        self.append(Instruction(matrix, name, (qubit,), params))
+
+    def kraus(self, operators, *qubits):
+        self.append(Instruction(np.asarray(operators), "kraus", qubits))
+
+    def append(self, instruction):
+        instructions = [instruction]
+        if self.noise_model is not None:
+            instructions += self.noise_model.channels(instruction)
+        for instruction in instructions:
+            matrix = None if instruction.matrix is None else np.asarray(instruction.matrix, dtype=self.dtype)
+            if matrix is not instruction.matrix:
+                # Gate matrices follow the precision of the state; the caller's instruction is left as it is
+                instruction = Instruction(
+                    matrix,
+                    instruction.name,
+                    instruction.qubits,
+                    instruction.params,
+                    instruction.num_controls,
+                )
+            self.instructions.append(instruction)
+        self._plan = None
+        self._branches = None
+        if not self.lazy:
+            self._flush()
+
+    def compile(self, fusion_width=2):
+        if self._plan is None or self._plan[0] != fusion_width:
+            self._plan = (fusion_width, compile_circuit(self.instructions, self.num_qubits, fusion_width, self.dtype))
+        return self._plan[1]
+
+    def _on_tableau(self):
+        return self._auto and isinstance(self.qubits, StabilizerTableau)
+
+    def _promote(self):
+        # Leaves the tableau for the state-vector engine. The instructions the tableau
+        # ran are replayed with every measurement forced to the outcome it gave, so the
+        # state, the position and `outcomes` carry over.
+        outcomes = iter(self.outcomes)
+        replay = [
+            Instruction(None, "measure", instruction.qubits, (next(outcomes),)) if instruction.name == "measure" else instruction
+            for instruction in self.instructions[:self._executed]
+        ]
+        self.qubits = Qubit(self.num_qubits, None, self.dtype)
+        self.qubits.run(compile_circuit(replay, self.num_qubits, dtype=self.dtype))
+
+    def run(self, fusion_width=2, initial_state=None, rng=None, prefix_cache=None, checkpoint=None, checkpoint_every=None):
+        """
+        Runs the whole circuit from |0...0> (or from initial_state).
+        ...
+        Args:
+            initial_state: Register to run the circuit on in place of the
+            circuit's own, e.g. Qubit.from_amplitudes(buffer). It holds the state
+            until the next run(), which goes back to the circuit's register and
+            leaves the caller's untouched.
+            prefix_cache: PrefixCache to start from the state of the longest cached
+            prefix of the instructions; the states this run passes through are
+            cached in turn (see resume).
+            checkpoint: Path that resume() saves the state to every
+            checkpoint_every instructions; see restore().
+        """
+        snapshots = prefix_cache is not None or checkpoint is not None
+        if initial_state is not None:
+            if prefix_cache is not None:
+                raise ValueError("Cached prefix states start from |0...0>, not from an initial state")
+            if self._own_register is None:
+                self._own_register = self.qubits
+            self.qubits = initial_state
+        else:
+            if self._own_register is not None:
+                # The last run's initial_state belongs to the caller and is not reset
+                self.qubits, self._own_register = self._own_register, None
+            if self._auto:
+                stabilizer = not snapshots and all(is_stabilizer(instruction) for instruction in self.instructions)
+                if stabilizer != isinstance(self.qubits, StabilizerTableau):
+                    backend = StabilizerTableau if stabilizer else Qubit
+                    self.qubits = backend(self.num_qubits, None, self.dtype)
+            self.qubits.reset()
+        if not snapshots:
+            self.outcomes = self.qubits.run(self.compile(fusion_width), rng)
+            self._executed = len(self.instructions)
+            return self
+        self._check_snapshots()
+        self.outcomes = []
+        self._executed = 0
+        if prefix_cache is not None:
+            entry = prefix_cache.lookup(self._cacheable_digests())
+            if entry is not None:
+                self._executed, state, outcomes = entry
+                self.qubits.state[...] = state
+                self.outcomes = list(outcomes)
+        return self.resume(fusion_width, rng, checkpoint, checkpoint_every, prefix_cache=prefix_cache)
+
+    def resume(self, fusion_width=2, rng=None, checkpoint=None, checkpoint_every=None, compressed=False, prefix_cache=None):
+        """
+        Runs the instructions from the current position to the end of the circuit,
+        e.g. after restore(). With a checkpoint path the state and position are
+        saved there after every checkpoint_every instructions and at the end, so a
+        run that dies can be restored from its last checkpoint and resumed. With a
+        prefix_cache the state is cached every prefix_cache.interval instructions
+        and at the end. Positions count from the start of the circuit, so circuits
+        that share a prefix share these boundaries.
+        """
+        self._dispatch()
+        rng = np.random.default_rng(rng)
+        end = len(self.instructions)
+        every = checkpoint_every or end
+        intervals = ([every] if checkpoint is not None else []) + ([prefix_cache.interval] if prefix_cache is not None else [])
+        if intervals:
+            self._check_snapshots()
+            digests, digested = prefix_digests(self.instructions, self._snapshot_seed()), 0
+            cacheable = self._first_draw()
+        while self._executed < end:
+            stop = min([end] + [(self._executed // interval + 1) * interval for interval in intervals])
+            plan = compile_circuit(self.instructions[self._executed:stop], self.num_qubits, fusion_width, self.dtype)
+            self.outcomes += self.qubits.run(plan, rng)
+            self._executed = stop
+            if not intervals:
+                continue
+            # The running digest only moves forward, one pass over the circuit in total
+            digest = next(islice(digests, stop - digested, None))
+            digested = stop + 1
+            if checkpoint is not None and (stop % every == 0 or stop == end):
+                save_checkpoint(checkpoint, self.qubits.state, stop, digest, self.outcomes, compressed)
+            if prefix_cache is not None and stop <= cacheable:
+                prefix_cache.store(digest, stop, self.qubits.state, self.outcomes)
+        return self
+
+    def _check_snapshots(self):
+        # Snapshots copy the amplitude array, which the tableau and the MPS do not keep
+        if self._on_tableau():
+            self._promote()
+        if not isinstance(self.qubits, (Qubit, ChunkedQubit, DensityMatrix)):
+            raise ValueError("{} has no state array to snapshot".format(type(self.qubits).__name__))
+
+    def _snapshot_seed(self):
+        return repr((isinstance(self.qubits, DensityMatrix), self.qubits.state.shape, np.dtype(self.dtype).str)).encode()
+
+    def _first_draw(self):
+        # Position of the first measurement whose outcome is drawn at run time; longer prefixes are not cached
+        for position, instruction in enumerate(self.instructions):
+            if instruction.name == "measure" and measured_outcome(instruction) is None:
+                return position
+        return len(self.instructions)
+
+    def _cacheable_digests(self):
+        return islice(prefix_digests(self.instructions, self._snapshot_seed()), self._first_draw() + 1)
+
+    def checkpoint(self, path, compressed=False):
+        """
+        Saves the state and the number of instructions applied so far to an .npz
+        file; restore() loads it into a circuit with the same instructions.
+        """
+        self._check_snapshots()
+        if not self.lazy:
+            self._flush()
+        for position, digest in enumerate(prefix_digests(self.instructions, self._snapshot_seed())):
+            if position == self._executed:
+                break
+        save_checkpoint(path, self.qubits.state, self._executed, digest, self.outcomes, compressed)
+
+    def restore(self, path):
+        """
+        Loads a checkpoint into this circuit and moves its position to the
+        checkpointed instruction, so resume() (or the next state access) continues
+        from there. The circuit must begin with the instructions the checkpoint ran.
+        """
+        snapshot = load_checkpoint(path)
+        self._check_snapshots()
+        position = snapshot["position"]
+        matches = snapshot["state"].shape == self.qubits.state.shape and position <= len(self.instructions)
+        if matches:
+            for index, digest in enumerate(prefix_digests(self.instructions, self._snapshot_seed())):
+                if index == position:
+                    break
+            matches = digest == snapshot["digest"]
+        if not matches:
+            raise ValueError("The checkpoint was taken on a different circuit or register")
+        self.qubits.state[...] = snapshot["state"]
+        self._executed = position
+        self.outcomes = snapshot["outcomes"]
+        return self
+
+    def _dispatch(self):
+        # Leaves the tableau when what is left of the circuit is not all Clifford
+        if self._on_tableau() and not all(is_stabilizer(instruction) for instruction in self.instructions[self._executed:]):
+            self._promote()
+
+    def _flush(self):
+        # Applies the recorded instructions that have not reached the state yet
+        self._dispatch()
+        for instruction in self.instructions[self._executed:]:
+            self.qubits.apply_instruction(instruction)
+        self._executed = len(self.instructions)
 
     def state_vector(self):
+        self._flush()
+        if self._on_tableau():
+            # The tableau only knows the state up to a global phase
+            self._promote()
         return np.round(self.qubits.state, decimals=3)
 
     def probabilities(self):
-        self.qubits.state /= np.linalg.norm(self.qubits.state)
-        return np.abs(self.qubits.state) ** 2
-
-    def measure_all(self, shots=1024):
-        args = initial_dict_state(self.qubits.state)
-        states = possible_bits(self.qubits.state)
-        for i in range(shots):
-            prob = self.probabilities()
-            ret = np.random.choice(states, p=prob)
-            args[ret] += 1
-
-        return args
-
-    def measure(self, qubit_index):
-        prob = self.probabilities()
-        res = np.random.choice(possible_bits(self.qubits.state), p=prob)
-        res = int(res[qubit_index])
-        # Sample according to probability distribution
-        self.qubits.state = project(qubit_index, res, self)
+        self._flush()
+        return self.qubits.probabilities()
+
+    @classmethod
+    def from_qasm(cls, source, lazy=True, **kwargs):
+        """
+        Circuit read from an OpenQASM 2 path or iterable of lines. Lazy by default,
+        so a long program is only recorded while it streams in.
+        """
+        return read_qasm(source, lambda num_qubits: cls(num_qubits, lazy=lazy, **kwargs))
+
+    def to_qasm(self, target):
+        write_qasm(self, target)
+
+    @classmethod
+    def load(cls, path, lazy=True, **kwargs):
+        """
+        Circuit backed by a memory-mapped circuit file (see write_circuit). The
+        instructions are read from the mapping as they are used, so loading takes
+        the same time for any circuit length. The precision defaults to that of
+        the saved matrices.
+        """
+        num_qubits, instructions = read_circuit(path)
+        kwargs.setdefault("dtype", instructions.dtype)
+        circuit = cls(num_qubits, lazy=lazy, **kwargs)
+        circuit.instructions = instructions
+        if not lazy:
+            circuit._flush()
+        return circuit
+
+    def save(self, path):
+        write_circuit(self.instructions, self.num_qubits, path)
+
+    def unitary(self, fusion_width=2):
+        """
+        The 2^n x 2^n unitary of the circuit. All basis columns go through the
+        compiled plan at once as a (2^n, 2^n) batched state whose row i starts as
+        |i>, so the cost is that of 2^n simulations, O(gates * 4^n), with no
+        operator products. Column i of the result is U|i>.
+        """
+        if self.batch_size is not None:
+            raise ValueError("A batched circuit has one unitary per row; build them from unbatched circuits")
+        if any(instruction.name in ("measure", "kraus") for instruction in self.instructions):
+            raise ValueError("Only circuits made of gates have a unitary")
+        columns = self.compile(fusion_width).run(np.eye(2 ** self.num_qubits, dtype=self.dtype))
+        return np.ascontiguousarray(columns.T)
+
+    def equivalent(self, other, atol=1e-8):
+        """
+        Whether two circuits implement the same unitary up to a global phase.
+        """
+        if other.num_qubits != self.num_qubits:
+            return False
+        return equal_up_to_global_phase(self.unitary(), other.unitary(), atol)
+
+    def expectation(self, observable):
+        """
+        Exact expectation value of weighted Pauli strings, e.g. {"ZZI": 0.5, "XIX": -1}
+        with the leftmost character on the highest qubit. Batched circuits give one
+        value per row; see expectation_value.
+        """
+        self._flush()
+        if isinstance(self.qubits, DensityMatrix):
+            return density_expectation_value(self.qubits.state, observable)
+        return expectation_value(self.qubits.state, observable)
+
+    def gradient(self, observable, method="adjoint", fusion_width=2):
+        """
+        d<H>/dangle for every rx, ry, rz and u3 angle, in circuit order (see
+        rotation_parameters). method="adjoint" (the default) uses one forward run and
+        one backward sweep; "parameter-shift" runs the shifted circuits as a batch.
+        """
+        if self.batch_size is not None:
+            raise ValueError("Gradients are taken of unbatched circuits")
+        if method == "adjoint":
+            return adjoint_gradient(self.instructions, self.num_qubits, observable, self.dtype, fusion_width)[1]
+        if method == "parameter-shift":
+            return parameter_shift_gradient(self.instructions, self.num_qubits, observable, self.dtype, fusion_width)
+        raise ValueError("Unknown gradient method {!r}".format(method))
+
+    def expectation_z(self, qubits):
+        label = "".join("Z" if qubit in qubits else "I" for qubit in reversed(range(self.num_qubits)))
+        return self.expectation(label)
+
+    def measure_all(self, shots=1024, rng=None, memory=False):
+        self._flush()
+        rng = np.random.default_rng(rng)
+        if self.noise_model is not None and self.noise_model.readout_errors:
+            samples = self.noise_model.apply_readout(self.qubits.sample_memory(shots, rng), self.num_qubits, rng)
+            if memory:
+                return samples
+            if samples.ndim == 2:
+                return [Counts.from_memory(row, self.num_qubits) for row in samples]
+            return Counts.from_memory(samples, self.num_qubits)
+        if memory:
+            return self.qubits.sample_memory(shots, rng)
+        return self.qubits.sample_counts(shots, rng)
+
+    def measure_trajectories(self, shots=1024, workers=None, seed=None, memory=False, fusion_width=2):
+        """
+        Samples a noisy circuit by Monte-Carlo trajectories on the state vector
+        instead of the density matrix; see run_trajectories. Build the circuit with
+        lazy=True so that appending gates does not simulate them on the density
+        matrix; it is then never allocated.
+        """
+        if self.batch_size is not None:
+            raise ValueError("Trajectories run one register per shot and cannot be used on a batched circuit")
+        samples = run_trajectories(self.instructions, self.num_qubits, shots, workers, seed, fusion_width, self.dtype)
+        if self.noise_model is not None and self.noise_model.readout_errors:
+            samples = self.noise_model.apply_readout(samples, self.num_qubits, np.random.default_rng(seed))
+        if memory:
+            return samples
+        return Counts.from_memory(samples, self.num_qubits)
+
+    def measure(self, qubit_index, rng=None):
+        if self.lazy:
+            self.append(Instruction(None, "measure", (qubit_index,)))
+            return None
+        self._flush()
+        # Marginal of one qubit and an in-place collapse; a batch gets one outcome per row
+        res = self.qubits.measure(qubit_index, np.random.default_rng(rng))
+        self.instructions.append(Instruction(None, "measure", (qubit_index,), (res,)))
+        self.outcomes.append(res)
+        self._executed = len(self.instructions)
+        self._plan = None
+        self._branches = None
         return res
 
+    def sample_branches(self, shots=1024, rng=None, fusion_width=2):
+        """
+        Samples a circuit with mid-circuit measurements without rerunning it per
+        shot: see BranchTree. Simulated branches stay cached until the circuit
+        changes, so later calls only simulate branches not reached before.
+        """
+        if self.batch_size is not None:
+            raise ValueError("Branching samples one register and cannot be used on a batched circuit")
+        if self._branches is None or self._branches[0] != fusion_width:
+            self._branches = (fusion_width, BranchTree(self.instructions, self.num_qubits, fusion_width, self.dtype))
+        return self._branches[1].sample(shots, rng)
+
 
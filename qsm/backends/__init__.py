@@ -0,0 +1,4 @@
+from qsm.backends.chunked import *
+from qsm.backends.mps import *
+from qsm.backends.stabilizer import *
+from qsm.backends.density import *
\ No newline at end of file
@@ -0,0 +1,230 @@
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+from qsm.compiler import compile_circuit, instruction_gate, measured_outcome, remap_instruction
+from qsm.kernels import apply_diagonal_gate
+from qsm.qubit import _check_dtype
+from qsm.results import Counts
+
+
+class ChunkedQubit:
+    """
+    Out-of-core state vector kept in a np.memmap file and processed in chunks of
+    2^chunk_qubits amplitudes. Qubits below chunk_qubits index inside a chunk,
+    higher qubits select the chunk.
+
+    A run of gates is applied group by group: a group is the set of chunks that
+    differ only in the high qubits the run touches, so gates on low qubits stay
+    chunk-local while gates on high qubits pair chunks up. Each group is read
+    once, gets every gate of the run, and is written back once. Phase vectors
+    never pair chunks up: each chunk gets the slice of the vector that its high
+    bits select, so a merged diagonal of any width runs one chunk at a time. Fused
+    blocks that span more than group_qubits high qubits are fused again at that
+    width from the circuit's own instructions.
+    ...
+    Args:
+        size: Number of qubits.
+        batch_size: Must be None, batched registers are not supported.
+        dtype: complex64 or complex128.
+        path: File backing the state. A temporary file is created when None, and
+        removed by close() or when the register is garbage-collected.
+        chunk_qubits: log2 of the number of amplitudes per chunk.
+        group_qubits: Largest number of high qubits one run of gates may touch,
+        i.e. at most 2^group_qubits chunks are held in memory at once.
+    """
+
+    def __init__(self, size, batch_size=None, dtype=np.complex128, path=None, chunk_qubits=20, group_qubits=2):
+        if batch_size is not None:
+            raise ValueError("The memmap backend does not support batched registers")
+        self.dtype = _check_dtype(dtype)
+        self.num_qubits = size
+        self.batch_size = None
+        self.chunk_qubits = min(chunk_qubits, size)
+        self.group_qubits = group_qubits
+        self._remove_file = None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".qsm")
+            os.close(handle)
+            self._remove_file = weakref.finalize(self, os.remove, path)
+        self.path = path
+        self.state = np.memmap(path, dtype=self.dtype, mode="w+", shape=(2 ** size,))
+        self.reset()
+
+    @property
+    def num_chunks(self):
+        return 2 ** (self.num_qubits - self.chunk_qubits)
+
+    def _chunks(self):
+        return self.state.reshape(self.num_chunks, 2 ** self.chunk_qubits)
+
+    def close(self):
+        self.state.flush()
+        self.state = None
+        if self._remove_file is not None:
+            self._remove_file()
+
+    def reset(self):
+        chunks = self._chunks()
+        for chunk in chunks:
+            chunk[...] = 0
+        chunks[0, 0] = 1
+        self.state.flush()
+
+    def _high_qubits(self, instruction):
+        # Qubits whose chunks the instruction pairs up
+        if instruction.name == "diagonal":
+            return set()
+        return {qubit for qubit in instruction.qubits if qubit >= self.chunk_qubits}
+
+    def _instructions(self, plan):
+        oversized = [
+            instruction
+            for instruction in plan.instructions
+            if instruction.name == "fused" and len(self._high_qubits(instruction)) > self.group_qubits
+        ]
+        if not oversized:
+            return plan.instructions
+        return compile_circuit(plan.source, self.num_qubits, self.group_qubits, self.dtype).instructions
+
+    def _apply_diagonal(self, chunk, index, instruction):
+        # The chunk index fixes the bits of the high qubits, leaving a phase vector over the low ones
+        qubits = instruction.qubits
+        phases = np.asarray(instruction.matrix).reshape((2,) * len(qubits))
+        bits = tuple(slice(None) if qubit < self.chunk_qubits else (index >> (qubit - self.chunk_qubits)) & 1 for qubit in qubits)
+        low = [qubit for qubit in qubits if qubit < self.chunk_qubits]
+        if low:
+            apply_diagonal_gate(chunk, phases[bits].reshape(-1), low)
+        else:
+            chunk *= phases[bits]
+
+    def _runs(self, instructions):
+        # Consecutive instructions grouped while their high qubits fit in one group
+        run, high = [], set()
+        for instruction in instructions:
+            needed = high | self._high_qubits(instruction)
+            if run and len(needed) > self.group_qubits:
+                yield run, sorted(high)
+                run, needed = [], self._high_qubits(instruction)
+            run.append(instruction)
+            high = needed
+        if run:
+            yield run, sorted(high)
+
+    def _apply_run(self, run, high):
+        chunks = self._chunks()
+        offsets = [qubit - self.chunk_qubits for qubit in high]
+        mapping = {qubit: qubit for qubit in range(self.chunk_qubits)}
+        mapping.update({qubit: self.chunk_qubits + position for position, qubit in enumerate(high)})
+        steps = [
+            None if instruction.name == "diagonal" else instruction_gate(remap_instruction(instruction, mapping))
+            for instruction in run
+        ]
+
+        # Row r of a group holds the chunk whose high bits are bit j of r at offsets[j]
+        members = np.zeros(1, dtype=np.int64)
+        for position, offset in enumerate(offsets):
+            members = np.concatenate([members, members | (1 << offset)])
+        mask = sum(1 << offset for offset in offsets)
+        for base in range(self.num_chunks):
+            if base & mask:
+                continue
+            rows = base | members
+            group = np.ascontiguousarray(chunks[rows]).reshape(-1)
+            for instruction, step in zip(run, steps):
+                if step is None:
+                    for index, chunk in zip(rows, group.reshape(len(rows), -1)):
+                        self._apply_diagonal(chunk, index, instruction)
+                else:
+                    gate, args = step
+                    group = gate.apply(group, *args)
+            chunks[rows] = group.reshape(len(rows), -1)
+        self.state.flush()
+
+    def run(self, plan, rng=None):
+        rng = np.random.default_rng(rng)
+        outcomes, gates = [], []
+        # Gates between measurements are grouped into runs, measurements stream on their own
+        for instruction in self._instructions(plan) + [None]:
+            if instruction is not None and instruction.name != "measure":
+                gates.append(instruction)
+                continue
+            for run, high in self._runs(gates):
+                self._apply_run(run, high)
+            gates = []
+            if instruction is not None:
+                outcomes.append(self.apply_instruction(instruction, rng))
+        return outcomes
+
+    def _bit_weights(self, qubit):
+        # Norm of the amplitudes with the qubit at 0 and at 1, chunk by chunk
+        weights = np.zeros(2)
+        for index, chunk in enumerate(self._chunks()):
+            if qubit < self.chunk_qubits:
+                weights += np.sum(np.abs(chunk.reshape(-1, 2, 1 << qubit)) ** 2, axis=(0, 2))
+            else:
+                weights[(index >> (qubit - self.chunk_qubits)) & 1] += np.vdot(chunk, chunk).real
+        return weights
+
+    def measure(self, qubit, rng=None, outcome=None):
+        weights = self._bit_weights(qubit)
+        if outcome is None:
+            outcome = int(np.random.default_rng(rng).random() * weights.sum() < weights[1])
+        if weights[outcome] <= 0:
+            raise ValueError("Outcome {} of qubit {} has probability zero".format(outcome, qubit))
+        keep = np.zeros(2)
+        keep[outcome] = 1 / np.sqrt(weights[outcome])
+        for index, chunk in enumerate(self._chunks()):
+            if qubit < self.chunk_qubits:
+                chunk.reshape(-1, 2, 1 << qubit)[...] *= keep[:, np.newaxis]
+            else:
+                chunk *= keep[(index >> (qubit - self.chunk_qubits)) & 1]
+        self.state.flush()
+        return outcome
+
+    def apply_instruction(self, instruction, rng=None):
+        if instruction.name == "measure":
+            return self.measure(instruction.qubits[0], rng, measured_outcome(instruction))
+        self._apply_run([instruction], sorted(self._high_qubits(instruction)))
+
+    def _chunk_norms(self):
+        return np.array([np.vdot(chunk, chunk).real for chunk in self._chunks()])
+
+    def probabilities(self, out=None):
+        """
+        Streams |amplitude|^2 chunk by chunk into `out`, which may itself be a
+        memmap; a new in-memory array is returned when None.
+        """
+        norm = self._chunk_norms().sum()
+        chunks = self._chunks()
+        if out is None:
+            out = np.empty(2 ** self.num_qubits)
+        out = out.reshape(chunks.shape)
+        for chunk, prob in zip(chunks, out):
+            prob[...] = np.abs(chunk) ** 2 / norm
+        return out.reshape(-1)
+
+    def _sample_chunks(self, shots, rng):
+        # Shots are split over the chunks first, then drawn inside each chunk, so
+        # only one chunk of probabilities is ever in memory
+        norms = self._chunk_norms()
+        chunk_shots = rng.multinomial(shots, norms / norms.sum())
+        chunks = self._chunks()
+        for index in np.flatnonzero(chunk_shots):
+            prob = np.abs(chunks[index]) ** 2
+            counts = rng.multinomial(chunk_shots[index], prob / prob.sum())
+            outcomes = np.flatnonzero(counts)
+            yield index * chunks.shape[1] + outcomes, counts[outcomes]
+
+    def sample_counts(self, shots, rng):
+        outcomes, counts = [], []
+        for chunk_outcomes, chunk_counts in self._sample_chunks(shots, rng):
+            outcomes.append(chunk_outcomes)
+            counts.append(chunk_counts)
+        return Counts(np.concatenate(outcomes), np.concatenate(counts), self.num_qubits)
+
+    def sample_memory(self, shots, rng):
+        memory = np.concatenate([np.repeat(outcomes, counts) for outcomes, counts in self._sample_chunks(shots, rng)])
+        return rng.permutation(memory)
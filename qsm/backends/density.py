@@ -0,0 +1,110 @@
+import numpy as np
+
+from qsm.compiler import instruction_gate, measured_outcome, remap_instruction
+from qsm.instruction import Instruction
+from qsm.qubit import _check_dtype
+from qsm.results import Counts
+
+
+class DensityMatrix:
+    """
+    Density-matrix register for noisy circuits. rho is stored flat as a 2n-qubit
+    vector, rho[row, column] at row * 2^n + column, so qubit q of the column index
+    is vector qubit q and qubit q of the row index is vector qubit q + n.
+
+    A gate U becomes U rho U^dagger by applying U to the row qubits and conj(U) to
+    the column qubits with the ordinary state-vector kernels. A Kraus channel on m
+    qubits is applied as its local 4^m x 4^m superoperator sum_k K (x) conj(K) on
+    those 2m vector qubits; no operator on the full 4^n space is ever formed.
+
+    rho itself is only allocated when it is first used, so a noisy circuit that
+    is sampled by trajectories never pays for it.
+    ...
+    Args:
+        size: Number of qubits.
+        batch_size: Must be None, batched registers are not supported.
+        dtype: complex64 or complex128.
+    """
+
+    def __init__(self, size, batch_size=None, dtype=np.complex128):
+        if batch_size is not None:
+            raise ValueError("The density-matrix backend does not support batched registers")
+        self.dtype = _check_dtype(dtype)
+        self.num_qubits = size
+        self.batch_size = None
+        self._vector = None
+
+    @property
+    def vector(self):
+        if self._vector is None:
+            self._vector = np.zeros(4 ** self.num_qubits, dtype=self.dtype)
+            self._vector[0] = 1
+        return self._vector
+
+    @vector.setter
+    def vector(self, vector):
+        self._vector = vector
+
+    @property
+    def state(self):
+        return self.vector.reshape(2 ** self.num_qubits, 2 ** self.num_qubits)
+
+    def reset(self):
+        if self._vector is not None:
+            self._vector.fill(0)
+            self._vector[0] = 1
+
+    def _apply(self, instruction):
+        gate, args = instruction_gate(instruction)
+        self.vector = gate.apply(self.vector, *args)
+
+    def measure(self, qubit, rng=None, outcome=None):
+        size = self.num_qubits
+        prob_one = self.probabilities().reshape(-1, 2, 1 << qubit)[:, 1].sum()
+        if outcome is None:
+            outcome = int(np.random.default_rng(rng).random() < prob_one)
+        prob = prob_one if outcome else 1 - prob_one
+        if prob <= 0:
+            raise ValueError("Outcome {} of qubit {} has probability zero".format(outcome, qubit))
+        # P rho P / p: keep the entries whose row and column bit both equal the outcome
+        keep = np.zeros(2)
+        keep[outcome] = 1
+        view = self.vector.reshape(-1, 2, 1 << (size - 1), 2, 1 << qubit)
+        view *= keep[:, np.newaxis, np.newaxis, np.newaxis] * keep[:, np.newaxis] / prob
+        return outcome
+
+    def apply_instruction(self, instruction, rng=None):
+        if instruction.name == "measure":
+            return self.measure(instruction.qubits[0], rng, measured_outcome(instruction))
+        size = self.num_qubits
+        if instruction.name == "kraus":
+            kraus = np.asarray(instruction.matrix)
+            dim = kraus.shape[-1]
+            superoperator = np.einsum("kab,kcd->acbd", kraus, kraus.conj()).reshape(dim * dim, dim * dim)
+            qubits = [qubit + size for qubit in instruction.qubits] + list(instruction.qubits)
+            self._apply(Instruction(superoperator.astype(self.dtype), "superoperator", qubits))
+            return
+        self._apply(remap_instruction(instruction, {qubit: qubit + size for qubit in instruction.qubits}))
+        column = remap_instruction(instruction, {qubit: qubit for qubit in instruction.qubits})
+        column.matrix = np.conj(column.matrix)
+        self._apply(column)
+
+    def run(self, plan, rng=None):
+        rng = np.random.default_rng(rng)
+        outcomes = []
+        for instruction in plan.instructions:
+            outcome = self.apply_instruction(instruction, rng)
+            if instruction.name == "measure":
+                outcomes.append(outcome)
+        return outcomes
+
+    def probabilities(self):
+        prob = np.real(np.diagonal(self.state)).copy()
+        return prob / prob.sum()
+
+    def sample_counts(self, shots, rng):
+        return Counts.from_dense(rng.multinomial(shots, self.probabilities()), self.num_qubits)
+
+    def sample_memory(self, shots, rng):
+        cumulative = np.cumsum(self.probabilities())
+        return np.searchsorted(cumulative, rng.random(shots) * cumulative[-1], side="right")
@@ -0,0 +1,182 @@
+import numpy as np
+
+from qsm.compiler import block_unitary, measured_outcome
+from qsm.gate_library.gate_matrix import swap
+from qsm.qubit import _check_dtype
+from qsm.results import Counts, outcomes_from_bits
+
+
+class MatrixProductState:
+    """
+    Matrix-product-state register for shallow or low-entanglement circuits. Site k
+    holds qubit k as a (left bond, 2, right bond) tensor and the state is kept in
+    mixed canonical form around `center`.
+
+    Single-qubit gates update one tensor. A gate on several qubits first moves them
+    next to each other with SWAPs, contracts their sites, applies the gate and
+    splits the result again with truncated SVDs, then moves them back. The weight
+    of every discarded singular value is added to `truncation_error`.
+    ...
+    Args:
+        size: Number of qubits.
+        batch_size: Must be None, batched registers are not supported.
+        dtype: complex64 or complex128.
+        max_bond: Largest bond dimension kept by a split.
+        cutoff: Singular values are dropped while their relative squared weight
+        stays below this value.
+    """
+
+    def __init__(self, size, batch_size=None, dtype=np.complex128, max_bond=64, cutoff=1e-12):
+        if batch_size is not None:
+            raise ValueError("The MPS backend does not support batched registers")
+        self.dtype = _check_dtype(dtype)
+        self.num_qubits = size
+        self.batch_size = None
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        self.reset()
+
+    def reset(self):
+        zero = np.zeros((1, 2, 1), dtype=self.dtype)
+        zero[0, 0, 0] = 1
+        self.tensors = [zero.copy() for _ in range(self.num_qubits)]
+        self.center = 0
+        self.truncation_error = 0.0
+
+    @property
+    def bond_dimensions(self):
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    def _move_center(self, site):
+        while self.center < site:
+            tensor = self.tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left * 2, right))
+            self.tensors[self.center] = q.reshape(left, 2, -1)
+            self.tensors[self.center + 1] = np.tensordot(r, self.tensors[self.center + 1], axes=(1, 0))
+            self.center += 1
+        while self.center > site:
+            tensor = self.tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left, 2 * right).T)
+            self.tensors[self.center] = q.T.reshape(-1, 2, right)
+            self.tensors[self.center - 1] = np.tensordot(self.tensors[self.center - 1], r.T, axes=(2, 0))
+            self.center -= 1
+
+    def _split(self, theta, site, num_sites):
+        # Splits a (left, 2^k, right) block back into k site tensors, left to right
+        left = theta.shape[0]
+        rest = theta.reshape(left, -1)
+        for offset in range(num_sites - 1):
+            rest = rest.reshape(left * 2, -1)
+            u, s, vh = np.linalg.svd(rest, full_matrices=False)
+            weights = s ** 2
+            total = weights.sum()
+            kept = len(s)
+            if total > 0:
+                # Drop the smallest values while their cumulative weight stays under the cutoff
+                tail = np.cumsum(weights[::-1])[::-1] / total
+                kept = max(1, int(np.sum(tail > self.cutoff)))
+            kept = min(kept, self.max_bond)
+            if total > 0:
+                self.truncation_error += float(weights[kept:].sum() / total)
+            s = s[:kept] * np.sqrt(total / weights[:kept].sum()) if total > 0 else s[:kept]
+            self.tensors[site + offset] = u[:, :kept].reshape(left, 2, kept).astype(self.dtype)
+            rest = (s[:, np.newaxis] * vh[:kept]).astype(self.dtype)
+            left = kept
+        self.tensors[site + num_sites - 1] = rest.reshape(left, 2, -1)
+        self.center = site + num_sites - 1
+
+    def _apply_sites(self, site, matrix, num_sites):
+        # Applies a 2^k x 2^k matrix to the adjacent sites site .. site + k - 1, the
+        # leftmost site being the most significant bit of the matrix index
+        self._move_center(site)
+        theta = self.tensors[site]
+        for offset in range(1, num_sites):
+            theta = np.tensordot(theta, self.tensors[site + offset], axes=(theta.ndim - 1, 0))
+        left, right = theta.shape[0], theta.shape[-1]
+        theta = theta.reshape(left, 2 ** num_sites, right)
+        theta = np.einsum("ij,ajb->aib", np.asarray(matrix, dtype=self.dtype), theta)
+        self._split(theta, site, num_sites)
+
+    def measure(self, qubit, rng=None, outcome=None):
+        self._move_center(qubit)
+        tensor = self.tensors[qubit]
+        weights = np.sum(np.abs(tensor) ** 2, axis=(0, 2))
+        if outcome is None:
+            outcome = int(np.random.default_rng(rng).random() * weights.sum() < weights[1])
+        if weights[outcome] <= 0:
+            raise ValueError("Outcome {} of qubit {} has probability zero".format(outcome, qubit))
+        # With the center on this site the projection only touches its tensor
+        tensor[:, 1 - outcome] = 0
+        tensor /= np.sqrt(weights[outcome])
+        return outcome
+
+    def apply_instruction(self, instruction, rng=None):
+        if instruction.name == "measure":
+            return self.measure(instruction.qubits[0], rng, measured_outcome(instruction))
+        qubits = sorted(instruction.qubits)
+        if len(qubits) == 1 and instruction.name != "diagonal":
+            self.tensors[qubits[0]] = np.einsum(
+                "ij,ajb->aib", np.asarray(instruction.matrix, dtype=self.dtype), self.tensors[qubits[0]]
+            )
+            return
+        # Bring the qubits next to the first one, apply, and move them back
+        swaps = []
+        for position, qubit in enumerate(qubits):
+            for site in range(qubit, qubits[0] + position, -1):
+                self._apply_sites(site - 1, swap(), 2)
+                swaps.append(site - 1)
+        self._apply_sites(qubits[0], block_unitary([instruction], qubits), len(qubits))
+        for site in reversed(swaps):
+            self._apply_sites(site, swap(), 2)
+
+    def run(self, plan, rng=None):
+        rng = np.random.default_rng(rng)
+        outcomes = []
+        for instruction in plan.source:
+            outcome = self.apply_instruction(instruction, rng)
+            if instruction.name == "measure":
+                outcomes.append(outcome)
+        return outcomes
+
+    @property
+    def state(self):
+        # Dense amplitudes; only practical for small registers
+        result = np.ones((1, 1), dtype=self.dtype)
+        for tensor in self.tensors:
+            result = np.tensordot(result, tensor, axes=(result.ndim - 1, 0))
+        result = result.reshape((2,) * self.num_qubits)
+        return np.ascontiguousarray(result.transpose(range(self.num_qubits - 1, -1, -1))).reshape(-1)
+
+    def probabilities(self):
+        prob = np.abs(self.state) ** 2
+        return prob / prob.sum()
+
+    def sample_bits(self, shots, rng, block=8192):
+        """
+        Draws shots straight from the MPS, qubit by qubit. With the center moved to
+        site 0 every other site is right-canonical, so the conditional probability
+        of each bit only needs the running left vector of each shot.
+        """
+        self._move_center(0)
+        bits = np.empty((shots, self.num_qubits), dtype=np.uint8)
+        for start in range(0, shots, block):
+            count = min(block, shots - start)
+            left = np.ones((count, 1), dtype=self.dtype)
+            for site, tensor in enumerate(self.tensors):
+                branch_zero = left @ tensor[:, 0, :]
+                branch_one = left @ tensor[:, 1, :]
+                weight_zero = np.sum(np.abs(branch_zero) ** 2, axis=1)
+                weight_one = np.sum(np.abs(branch_one) ** 2, axis=1)
+                outcome = rng.random(count) * (weight_zero + weight_one) >= weight_zero
+                bits[start:start + count, site] = outcome
+                left = np.where(outcome[:, np.newaxis], branch_one, branch_zero)
+                left /= np.linalg.norm(left, axis=1, keepdims=True)
+        return bits
+
+    def sample_memory(self, shots, rng):
+        return outcomes_from_bits(self.sample_bits(shots, rng))
+
+    def sample_counts(self, shots, rng):
+        return Counts.from_memory(self.sample_memory(shots, rng), self.num_qubits)
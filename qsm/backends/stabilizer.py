@@ -0,0 +1,312 @@
+import numpy as np
+
+from qsm.compiler import measured_outcome
+from qsm.qubit import _check_dtype
+from qsm.results import Counts, outcomes_from_bits
+
+CLIFFORD_GATES = {"h": 1, "s": 1, "sdg": 1, "x": 1, "y": 1, "z": 1, "cx": 2, "cy": 2, "cz": 2, "swap": 2}
+
+
+def is_clifford(instruction):
+    return CLIFFORD_GATES.get(instruction.name) == len(instruction.qubits)
+
+
+def is_stabilizer(instruction):
+    # Clifford gates and Z measurements keep a stabilizer state a stabilizer state
+    return instruction.name == "measure" or is_clifford(instruction)
+
+
+# Masks and shifts of the SWAR popcount (np.bitwise_count needs NumPy 2)
+_M1, _M2, _M4, _H01 = (np.uint64(mask) for mask in (0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101))
+_S1, _S2, _S4, _S56 = (np.uint64(shift) for shift in (1, 2, 4, 56))
+
+
+def _words(num_bits):
+    return (num_bits + 63) // 64
+
+
+def _popcount(words):
+    # Set bits per row of a (..., words) uint64 array, counted in parallel within each word
+    words = words - ((words >> _S1) & _M1)
+    words = (words & _M2) + ((words >> _S2) & _M2)
+    words = (words + (words >> _S4)) & _M4
+    return ((words * _H01) >> _S56).astype(np.int64).sum(axis=-1)
+
+
+def unpack_bits(words, num_bits):
+    """
+    Bool columns of packed rows: bit k of a row is bit k % 64 of word k // 64.
+    """
+    bytes_ = np.ascontiguousarray(words, dtype="<u8").view(np.uint8)
+    return np.unpackbits(bytes_, axis=-1, bitorder="little")[..., :num_bits].astype(bool)
+
+
+def pack_bits(bits):
+    # Inverse of unpack_bits for a (rows, num_bits) bool array
+    rows, num_bits = bits.shape
+    padded = np.zeros((rows, _words(num_bits) * 64), dtype=bool)
+    padded[:, :num_bits] = bits
+    return np.packbits(padded, axis=-1, bitorder="little").view("<u8").astype(np.uint64)
+
+
+def _column(words, qubit):
+    # Bit `qubit` of every packed row, as 0/1 uint64
+    return (words[:, qubit >> 6] >> np.uint64(qubit & 63)) & np.uint64(1)
+
+
+def _flip_column(words, qubit, bits):
+    words[:, qubit >> 6] ^= bits << np.uint64(qubit & 63)
+
+
+def _phase(x1, z1, x2, z2):
+    """
+    Power of i (mod 4, summed over the last axis) picked up when the packed Pauli
+    rows (x1, z1) multiply (x2, z2) from the left: +1 for each XY, YZ and ZX pair
+    of (source, target) Paulis, -1 (+3) for each YX, ZY and XZ pair. Every
+    anticommuting pair counts 1, and the -1 pairs, the ones whose product has
+    odd x ^ z parity once x1 & z2 is folded in, count 2 more.
+    """
+    x1z2 = x1 & z2
+    anticommuting = (x2 & z1) ^ x1z2
+    negative = (x1 ^ x2 ^ z1 ^ z2 ^ x1z2) & anticommuting
+    return (_popcount(anticommuting) + 2 * _popcount(negative)) % 4
+
+
+def _rowsum(x, z, signs, rows, source):
+    """
+    Multiplies the Pauli rows `rows` by row `source` in place (rowsum of Aaronson
+    and Gottesman). Rows are bit-packed into uint64 words; bit 0 of signs is the
+    constant sign, any further bits are symbolic measurement variables and are
+    simply XORed along.
+    """
+    if not len(rows):
+        return
+    x1, z1 = x[source], z[source]
+    phase = _phase(x1, z1, x[rows], z[rows]) // 2
+    x[rows] ^= x1
+    z[rows] ^= z1
+    signs[rows] ^= signs[source]
+    signs[rows, 0] ^= phase.astype(np.uint64)
+
+
+def _product_sign(x, z, signs, rows):
+    # Packed sign of the product of the Pauli rows `rows`, taken in order
+    if not len(rows):
+        return np.zeros(signs.shape[1], dtype=np.uint64)
+    x1, z1 = x[rows], z[rows]
+    # Row k multiplies the product of the rows before it
+    x2, z2 = np.zeros_like(x1), np.zeros_like(z1)
+    x2[1:] = np.bitwise_xor.accumulate(x1, axis=0)[:-1]
+    z2[1:] = np.bitwise_xor.accumulate(z1, axis=0)[:-1]
+    sign = np.bitwise_xor.reduce(signs[rows], axis=0)
+    sign[0] ^= np.uint64(int(_phase(x1, z1, x2, z2).sum()) % 4 // 2)
+    return sign
+
+
+def _measure(x, z, signs, qubit):
+    """
+    Z measurement of one qubit on a packed tableau, updated in place. Returns the
+    row that now holds +-Z_qubit when the outcome is random (its sign is left for
+    the caller to set), or None and the packed sign of the deterministic outcome.
+    """
+    size = x.shape[0] // 2
+    column = _column(x, qubit).astype(bool)
+    anticommuting = np.flatnonzero(column[size:])
+    if len(anticommuting):
+        pivot = size + anticommuting[0]
+        rows = np.flatnonzero(column)
+        _rowsum(x, z, signs, rows[rows != pivot], pivot)
+        x[pivot - size], z[pivot - size], signs[pivot - size] = x[pivot], z[pivot], signs[pivot]
+        x[pivot], z[pivot], signs[pivot] = 0, 0, 0
+        z[pivot, qubit >> 6] = np.uint64(1) << np.uint64(qubit & 63)
+        return pivot, None
+    return None, _product_sign(x, z, signs, size + np.flatnonzero(column[:size]))
+
+
+class StabilizerTableau:
+    """
+    Stabilizer register in the CHP tableau form of Aaronson and Gottesman: rows
+    0..n-1 are destabilizers, rows n..2n-1 stabilizers, each stored as X and Z bit
+    rows plus a sign. The rows are packed 64 qubits to a uint64 word, so Clifford
+    gates update one bit column in O(n) and a measurement costs O(n^2 / 64) word
+    operations, which keeps registers of thousands of qubits cheap.
+
+    measure_all measures every qubit once symbolically: a random outcome becomes a
+    fresh variable, a deterministic one an XOR of earlier variables, so every
+    outcome is an affine function of the random bits. Shots are then drawn with one
+    matrix product mod 2, and the affine map is cached until the next gate.
+    ...
+    Args:
+        size: Number of qubits.
+        batch_size: Must be None, batched registers are not supported.
+        dtype: Precision of the amplitudes returned by `state`.
+    """
+
+    def __init__(self, size, batch_size=None, dtype=np.complex128):
+        if batch_size is not None:
+            raise ValueError("The stabilizer backend does not support batched registers")
+        self.dtype = _check_dtype(dtype)
+        self.num_qubits = size
+        self.batch_size = None
+        self.reset()
+
+    def reset(self):
+        size = self.num_qubits
+        identity = pack_bits(np.eye(size, dtype=bool))
+        zeros = np.zeros_like(identity)
+        self.x = np.vstack([identity, zeros])
+        self.z = np.vstack([zeros, identity])
+        self.signs = np.zeros((2 * size, 1), dtype=np.uint64)
+        self._sampler = None
+
+    def _h(self, qubit):
+        x, z = _column(self.x, qubit), _column(self.z, qubit)
+        self.signs[:, 0] ^= x & z
+        _flip_column(self.x, qubit, x ^ z)
+        _flip_column(self.z, qubit, x ^ z)
+
+    def _s(self, qubit):
+        x = _column(self.x, qubit)
+        self.signs[:, 0] ^= x & _column(self.z, qubit)
+        _flip_column(self.z, qubit, x)
+
+    def _sdg(self, qubit):
+        self._s(qubit)
+        self.signs[:, 0] ^= _column(self.x, qubit)
+
+    def _cx(self, control, target):
+        x_control, z_control = _column(self.x, control), _column(self.z, control)
+        x_target, z_target = _column(self.x, target), _column(self.z, target)
+        self.signs[:, 0] ^= x_control & z_target & (x_target ^ z_control ^ np.uint64(1))
+        _flip_column(self.x, target, x_control)
+        _flip_column(self.z, control, z_target)
+
+    def apply_instruction(self, instruction, rng=None):
+        if instruction.name == "measure":
+            return self.measure(instruction.qubits[0], rng, measured_outcome(instruction))
+        if not is_clifford(instruction):
+            raise ValueError("The stabilizer backend only runs Clifford gates, not {}".format(instruction.name))
+        self._sampler = None
+        name, qubits = instruction.name, instruction.qubits
+        if name == "h":
+            self._h(*qubits)
+        elif name == "s":
+            self._s(*qubits)
+        elif name == "sdg":
+            self._sdg(*qubits)
+        elif name in ("x", "y", "z"):
+            x, z = _column(self.x, qubits[0]), _column(self.z, qubits[0])
+            self.signs[:, 0] ^= {"x": z, "y": x ^ z, "z": x}[name]
+        elif name == "cx":
+            self._cx(*qubits)
+        elif name == "cz":
+            self._h(qubits[1])
+            self._cx(*qubits)
+            self._h(qubits[1])
+        elif name == "cy":
+            self._sdg(qubits[1])
+            self._cx(*qubits)
+            self._s(qubits[1])
+        else:
+            for words in (self.x, self.z):
+                differ = _column(words, qubits[0]) ^ _column(words, qubits[1])
+                _flip_column(words, qubits[0], differ)
+                _flip_column(words, qubits[1], differ)
+
+    def run(self, plan, rng=None):
+        rng = np.random.default_rng(rng)
+        outcomes = []
+        for instruction in plan.source:
+            outcome = self.apply_instruction(instruction, rng)
+            if instruction.name == "measure":
+                outcomes.append(outcome)
+        return outcomes
+
+    def measure(self, qubit, rng=None, outcome=None):
+        """
+        Measures one qubit in the Z basis and collapses the tableau. A forced
+        outcome must have nonzero probability.
+        """
+        self._sampler = None
+        pivot, sign = _measure(self.x, self.z, self.signs, qubit)
+        if pivot is None:
+            if outcome is not None and outcome != int(sign[0]):
+                raise ValueError("Outcome {} of qubit {} has probability zero".format(outcome, qubit))
+            return int(sign[0])
+        if outcome is None:
+            outcome = int(np.random.default_rng(rng).integers(2))
+        self.signs[pivot, 0] = np.uint64(outcome)
+        return outcome
+
+    def _affine_outcomes(self):
+        # Outcome bit k = offsets[k] ^ (random bits . coefficients[:, k]) mod 2
+        if self._sampler is None:
+            size = self.num_qubits
+            x, z = self.x.copy(), self.z.copy()
+            # Bit 0 is the constant sign, bit k the k-th random outcome
+            signs = np.zeros((2 * size, _words(size + 1)), dtype=np.uint64)
+            signs[:, 0] = self.signs[:, 0]
+            rows, variables = [], 0
+            for qubit in range(size):
+                pivot, sign = _measure(x, z, signs, qubit)
+                if pivot is not None:
+                    variables += 1
+                    signs[pivot] = 0
+                    signs[pivot, variables >> 6] = np.uint64(1) << np.uint64(variables & 63)
+                    sign = signs[pivot].copy()
+                rows.append(sign)
+            rows = unpack_bits(np.array(rows), size + 1)
+            self._sampler = rows[:, 0], rows[:, 1:variables + 1].T
+        return self._sampler
+
+    def sample_bits(self, shots, rng):
+        offsets, coefficients = self._affine_outcomes()
+        draws = rng.integers(0, 2, size=(shots, len(coefficients))).astype(np.float32)
+        # float32 products are exact for up to 2^24 random variables
+        return (draws @ coefficients.astype(np.float32)).astype(np.int64) % 2 ^ offsets
+
+    def sample_memory(self, shots, rng):
+        return outcomes_from_bits(self.sample_bits(shots, rng))
+
+    def sample_counts(self, shots, rng):
+        return Counts.from_memory(self.sample_memory(shots, rng), self.num_qubits)
+
+    def probabilities(self):
+        # Uniform over the 2^m outcomes of the affine map; dense, so small registers only
+        offsets, coefficients = self._affine_outcomes()
+        variables = len(coefficients)
+        draws = (np.arange(2 ** variables)[:, np.newaxis] >> np.arange(variables)) & 1
+        outcomes = outcomes_from_bits((draws @ coefficients.astype(np.int64)) % 2 ^ offsets)
+        prob = np.zeros(2 ** self.num_qubits)
+        prob[outcomes] = 2.0 ** -variables
+        return prob
+
+    @property
+    def state(self):
+        """
+        Dense amplitudes, obtained by projecting a basis state in the support onto
+        the stabilized subspace. Defined up to a global phase; small registers only.
+        The array is a read-only copy, since writing to it cannot reach the tableau.
+        """
+        size = self.num_qubits
+        offsets, _ = self._affine_outcomes()
+        index = np.arange(2 ** size)
+        state = np.zeros(2 ** size, dtype=self.dtype)
+        state[outcomes_from_bits(offsets[np.newaxis])[0]] = 1
+        powers = 1 << np.arange(size, dtype=np.int64)
+        x, z = unpack_bits(self.x, size), unpack_bits(self.z, size)
+        for row in range(size, 2 * size):
+            x_mask, z_mask = int(powers[x[row]].sum()), int(powers[z[row]].sum())
+            # X^x Z^z per qubit, with an extra factor i for every Y
+            phase = (-1) ** int(self.signs[row, 0]) * 1j ** int(np.sum(x[row] & z[row]))
+            parity = np.zeros(2 ** size, dtype=np.int64)
+            masked = index & z_mask
+            while masked.any():
+                parity ^= masked & 1
+                masked >>= 1
+            image = np.empty_like(state)
+            image[index ^ x_mask] = phase * (1 - 2 * parity) * state
+            state = (state + image) / 2
+        state /= np.linalg.norm(state)
+        state.flags.writeable = False
+        return state
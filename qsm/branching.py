@@ -0,0 +1,84 @@
+import numpy as np
+
+from qsm.compiler import compile_circuit, measured_outcome
+from qsm.kernels import collapse, marginal_probability
+from qsm.results import Counts
+
+
+class BranchTree:
+    """
+    Shot sampling for circuits with mid-circuit measurements. The circuit is split
+    at its measurements and every distinct sequence of outcomes is simulated once:
+    the state reached after a prefix of outcomes is cached, so the gates before the
+    first measurement run a single time and each later segment once per branch
+    that shots actually reach. Shots are routed down the tree binomially with the
+    marginal probability of each measurement and drawn from the leaf states.
+
+    The cache keeps one state vector per visited branch, so its memory grows with
+    the number of distinct outcome prefixes.
+    ...
+    Args:
+        instructions: The circuit's instructions, "measure" ones included.
+        num_qubits: Width of the register.
+        fusion_width: Gate-fusion width for the segments.
+        dtype: complex64 or complex128.
+    """
+
+    def __init__(self, instructions, num_qubits, fusion_width=2, dtype=np.complex128):
+        self.num_qubits = num_qubits
+        self.dtype = dtype
+        self.measurements = [instruction for instruction in instructions if instruction.name == "measure"]
+        self.segments, gates = [], []
+        for instruction in instructions:
+            if instruction.name == "measure":
+                self.segments.append(compile_circuit(gates, num_qubits, fusion_width, dtype))
+                gates = []
+            else:
+                gates.append(instruction)
+        self.segments.append(compile_circuit(gates, num_qubits, fusion_width, dtype))
+        self.states = {}
+
+    def state(self, prefix):
+        """
+        State after the measurements in `prefix` gave those outcomes and the gates
+        up to the next measurement ran. Cached by prefix.
+        """
+        prefix = tuple(prefix)
+        if prefix not in self.states:
+            if prefix:
+                state = self.state(prefix[:-1]).copy()
+                qubit = self.measurements[len(prefix) - 1].qubits[0]
+                prob_one = marginal_probability(state, qubit)
+                collapse(state, qubit, prefix[-1], prob_one if prefix[-1] else 1 - prob_one)
+            else:
+                state = np.zeros(2 ** self.num_qubits, dtype=self.dtype)
+                state[0] = 1
+            self.states[prefix] = self.segments[len(prefix)].run(state)
+        return self.states[prefix]
+
+    def sample(self, shots, rng=None):
+        """
+        Returns a dict from the measurement record to the Counts of the final
+        register for the shots that produced it. Measurement j is bit j of the
+        record, so the record string reads last measurement first.
+        """
+        rng = np.random.default_rng(rng)
+        results = {}
+        pending = [((), shots)]
+        while pending:
+            prefix, count = pending.pop()
+            state = self.state(prefix)
+            if len(prefix) == len(self.measurements):
+                prob = np.abs(state) ** 2
+                record = "".join(str(outcome) for outcome in reversed(prefix))
+                results[record] = Counts.from_dense(rng.multinomial(count, prob / prob.sum()), self.num_qubits)
+                continue
+            measurement = self.measurements[len(prefix)]
+            recorded = measured_outcome(measurement)
+            if recorded is not None:
+                # An eager measurement already happened: every shot follows its outcome
+                pending.append((prefix + (int(recorded),), count))
+                continue
+            ones = rng.binomial(count, marginal_probability(state, measurement.qubits[0]))
+            pending.extend((prefix + (outcome,), part) for outcome, part in ((0, count - ones), (1, ones)) if part)
+        return results
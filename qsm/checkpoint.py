@@ -0,0 +1,114 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def instruction_bytes(instruction):
+    # Parameters and matrices are hashed in double precision, so a circuit read back from a file digests the same
+    parts = [repr((instruction.name, tuple(int(qubit) for qubit in instruction.qubits), instruction.num_controls)).encode()]
+    parts += [np.asarray(param, dtype=np.float64).tobytes() for param in instruction.params]
+    if instruction.matrix is not None:
+        parts.append(np.asarray(instruction.matrix, dtype=np.complex128).tobytes())
+    return b"".join(parts)
+
+
+def prefix_digests(instructions, seed=b""):
+    """
+    Yields the digest of instructions[:0], instructions[:1], ... in turn, one running
+    SHA-1 over the instructions, so every prefix of a circuit is digested in a
+    single pass. The seed describes the register the instructions act on.
+    """
+    digest = hashlib.sha1(seed)
+    yield digest.digest()
+    for instruction in instructions:
+        digest.update(instruction_bytes(instruction))
+        yield digest.digest()
+
+
+def save_checkpoint(path, state, position, digest, outcomes=(), compressed=False):
+    """
+    Writes a register state together with the number of instructions it has run
+    and the digest of those instructions, as an .npz archive (zip-deflated when
+    compressed=True, which pays off for sparse or structured states).
+    """
+    save = np.savez_compressed if compressed else np.savez
+    with open(path, "wb") as handle:
+        save(
+            handle,
+            state=np.asarray(state),
+            position=np.int64(position),
+            digest=np.frombuffer(digest, dtype=np.uint8),
+            outcomes=np.asarray(outcomes, dtype=np.int64),
+        )
+
+
+def load_checkpoint(path):
+    with np.load(path) as archive:
+        return {
+            "state": archive["state"],
+            "position": int(archive["position"]),
+            "digest": archive["digest"].tobytes(),
+            "outcomes": list(archive["outcomes"]),
+        }
+
+
+class PrefixCache:
+    """
+    Bounded LRU cache of simulated states keyed by the digest of the instructions
+    that produced them (see prefix_digests). A run with a cache stores its state
+    every `interval` instructions, counted from the start of the circuit, so
+    circuits that share a prefix of gates start from the state cached at the
+    last boundary inside that prefix instead of simulating it again. The cache
+    holds at most max_bytes of states, which are stored as read-only copies.
+    """
+
+    def __init__(self, max_bytes=2 ** 30, interval=256):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, digests):
+        """
+        The (position, state, outcomes) cached for the longest prefix among digests,
+        an iterable of the digests of the first 0, 1, 2, ... instructions, or None.
+        """
+        found = None
+        for digest in digests:
+            if digest in self._entries:
+                found = digest
+        with self._lock:
+            entry = self._entries.get(found)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(found)
+            return entry
+
+    def store(self, digest, position, state, outcomes=()):
+        state = np.array(state)
+        if state.nbytes > self.max_bytes:
+            return
+        state.setflags(write=False)
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self.nbytes -= previous[1].nbytes
+            self._entries[digest] = (position, state, list(outcomes))
+            self.nbytes += state.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
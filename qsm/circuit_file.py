@@ -0,0 +1,215 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from qsm.instruction import Instruction
+
+MAGIC = b"\x93QSMCIRC"
+FORMAT_VERSION = 1
+MAX_QUBITS = 8
+MAX_PARAMS = 3
+
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("num_qubits", "<u4"),
+    ("num_instructions", "<u8"),
+    ("names_offset", "<u8"),
+    ("names_size", "<u8"),
+    ("matrices_offset", "<u8"),
+    ("num_matrices", "<u8"),
+    ("pool_offset", "<u8"),
+    ("pool_size", "<u8"),
+    ("pool_dtype", "S8"),
+    ("records_offset", "<u8"),
+])
+
+# One fixed-size record per instruction; matrix indexes the matrix table, -1 for none
+RECORD = np.dtype([
+    ("opcode", "<u2"),
+    ("num_qubits", "u1"),
+    ("num_controls", "u1"),
+    ("num_params", "u1"),
+    ("qubits", "<u4", (MAX_QUBITS,)),
+    ("params", "<f8", (MAX_PARAMS,)),
+    ("matrix", "<i8"),
+], align=True)
+
+# Where each distinct matrix lives in the matrix pool, and its shape
+MATRIX = np.dtype([("offset", "<u8"), ("ndim", "<u8"), ("shape", "<u8", (3,))])
+
+
+def _aligned(offset):
+    return (offset + 63) // 64 * 64
+
+
+class InstructionTable(Sequence):
+    """
+    The instructions of a circuit file, read straight from the memory-mapped record
+    array. Instruction objects are only built when an entry is accessed, and their
+    matrices are read-only views into the mapped matrix pool, made the first time
+    an instruction refers to them, so loading costs the same for any circuit
+    length. Instructions appended afterwards are kept in a plain list after the
+    mapped ones.
+    """
+
+    def __init__(self, records, names, table, pool):
+        self.records = records
+        self.names = names
+        self.table = table
+        self.pool = pool
+        self.dtype = pool.dtype
+        self.appended = []
+        self._matrices = {}
+
+    def matrix(self, index):
+        # One view per distinct matrix, so equal gates share their matrix object as in a built circuit
+        matrix = self._matrices.get(index)
+        if matrix is None:
+            entry = self.table[index]
+            offset = int(entry["offset"])
+            shape = tuple(int(size) for size in entry["shape"][:int(entry["ndim"])])
+            matrix = self._matrices[index] = self.pool[offset:offset + int(np.prod(shape))].reshape(shape)
+        return matrix
+
+    def _instruction(self, opcode, num_qubits, num_controls, num_params, qubits, params, matrix):
+        return Instruction(
+            None if matrix < 0 else self.matrix(matrix),
+            self.names[opcode],
+            qubits[:num_qubits],
+            params[:num_params],
+            num_controls,
+        )
+
+    def __len__(self):
+        return len(self.records) + len(self.appended)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index >= len(self.records):
+            return self.appended[index - len(self.records)]
+        record = self.records[index]
+        return self._instruction(*(record[field].tolist() for field in RECORD.names))
+
+    def __iter__(self, block=65536):
+        # Converts the mapped fields a block at a time instead of record by record
+        for start in range(0, len(self.records), block):
+            fields = [self.records[field][start:start + block].tolist() for field in RECORD.names]
+            for values in zip(*fields):
+                yield self._instruction(*values)
+        yield from self.appended
+
+    def append(self, instruction):
+        self.appended.append(instruction)
+
+
+def write_circuit(instructions, num_qubits, path):
+    """
+    Saves instructions in the binary circuit format: a versioned header, the table
+    of instruction names, a table and pool of the distinct matrices, and one
+    RECORD per instruction, each section 64-byte aligned for np.memmap. The pool
+    keeps the precision of the matrices (complex64 or complex128).
+    """
+    names, opcodes = [], {}
+    distinct, by_id, by_content = [], {}, {}
+    opcode, widths, controls, num_params, qubits, params, matrix_index = ([] for _ in range(7))
+    for instruction in instructions:
+        if len(instruction.qubits) > MAX_QUBITS or len(instruction.params) > MAX_PARAMS:
+            raise ValueError("{!r} does not fit a circuit file record".format(instruction))
+        if any(np.ndim(param) for param in instruction.params):
+            raise ValueError("Batched parameters cannot be saved: {!r}".format(instruction))
+        if instruction.name not in opcodes:
+            opcodes[instruction.name] = len(names)
+            names.append(instruction.name)
+        matrix = -1
+        if instruction.matrix is not None:
+            # Shared gate-cache matrices are found by identity, copies (e.g. cast by append) by content
+            matrix = by_id.get(id(instruction.matrix))
+            if matrix is None:
+                array = np.ascontiguousarray(instruction.matrix)
+                key = (array.dtype.str, array.shape, array.tobytes())
+                matrix = by_content.get(key)
+                if matrix is None:
+                    matrix = by_content[key] = len(distinct)
+                    distinct.append(array)
+                by_id[id(instruction.matrix)] = matrix
+        opcode.append(opcodes[instruction.name])
+        widths.append(len(instruction.qubits))
+        controls.append(instruction.num_controls)
+        num_params.append(len(instruction.params))
+        qubits.append(instruction.qubits)
+        params.append(instruction.params)
+        matrix_index.append(matrix)
+    records = np.zeros(len(opcode), dtype=RECORD)
+    # Columns are filled whole, the ragged qubit and parameter lists grouped by length
+    for field, column in (("opcode", opcode), ("num_qubits", widths), ("num_controls", controls),
+                          ("num_params", num_params), ("matrix", matrix_index)):
+        records[field] = column
+    for field, lengths, rows in (("qubits", widths, qubits), ("params", num_params, params)):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        for length in np.unique(lengths):
+            if length:
+                positions = np.flatnonzero(lengths == length)
+                records[field][positions, :length] = [rows[position] for position in positions]
+
+    pool_dtype = np.dtype(np.result_type(np.complex64, *(array.dtype for array in distinct))).newbyteorder("<")
+    names_block = "\n".join(names).encode("utf-8")
+    table = np.zeros(len(distinct), dtype=MATRIX)
+    offset = 0
+    for entry, array in zip(table, distinct):
+        entry["offset"] = offset
+        entry["ndim"] = array.ndim
+        entry["shape"][:array.ndim] = array.shape
+        offset += array.size
+    pool = np.concatenate([array.ravel() for array in distinct]).astype(pool_dtype) if distinct else np.zeros(0, dtype=pool_dtype)
+
+    header = np.zeros((), dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["num_qubits"] = num_qubits
+    header["num_instructions"] = len(records)
+    header["names_offset"] = _aligned(HEADER.itemsize)
+    header["names_size"] = len(names_block)
+    header["matrices_offset"] = _aligned(header["names_offset"] + len(names_block))
+    header["num_matrices"] = len(table)
+    header["pool_offset"] = _aligned(header["matrices_offset"] + table.nbytes)
+    header["pool_size"] = pool.size
+    header["pool_dtype"] = pool_dtype.str.encode()
+    header["records_offset"] = _aligned(header["pool_offset"] + pool.nbytes)
+    with open(path, "wb") as handle:
+        for offset, block in ((0, header.tobytes()), (header["names_offset"], names_block),
+                              (header["matrices_offset"], table.tobytes()),
+                              (header["pool_offset"], pool.tobytes()),
+                              (header["records_offset"], records.tobytes())):
+            handle.seek(int(offset))
+            handle.write(block)
+
+
+def _mapped(path, dtype, offset, count):
+    # np.memmap cannot map zero bytes
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=int(offset), shape=(int(count),))
+
+
+def read_circuit(path):
+    """
+    Maps a circuit file. Returns (num_qubits, InstructionTable); only the header
+    and the name table are read up front, the matrix table, the matrix pool and
+    the records are mapped.
+    """
+    header = np.fromfile(path, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError("{} is not a qsm circuit file".format(path))
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("Circuit file version {} is not supported (expected {})".format(header["version"], FORMAT_VERSION))
+    with open(path, "rb") as handle:
+        handle.seek(int(header["names_offset"]))
+        names = handle.read(int(header["names_size"])).decode("utf-8").split("\n")
+    table = _mapped(path, MATRIX, header["matrices_offset"], header["num_matrices"])
+    pool = _mapped(path, np.dtype(header["pool_dtype"].decode()), header["pool_offset"], header["pool_size"])
+    records = _mapped(path, RECORD, header["records_offset"], header["num_instructions"])
+    return int(header["num_qubits"]), InstructionTable(records, names, table, pool)
@@ -0,0 +1,264 @@
+import numpy as np
+
+from qsm.instruction import Instruction
+from qsm.kernels import is_diagonal, measure_qubit
+from qsm.gate_library.gate import SingelletonGate, MultiQubitGate, DiagonalGate
+from qsm.gate_library.controlled_gate import Controlled2By2Gate, ControlledGate, SwapGate
+from qsm.gate_library.controlled_controlled_gate import Toffolie
+
+
+# Widest phase vector (in qubits) that merge_diagonals builds for one block
+DIAGONAL_BLOCK_WIDTH = 12
+
+
+def instruction_gate(instruction):
+    """
+    Binds an Instruction to the gate object that applies it, together with the
+    qubit arguments that the gate's apply() expects after the state.
+    """
+    if instruction.name == "kraus":
+        raise ValueError("Kraus channels need the density-matrix backend")
+    if instruction.name == "diagonal":
+        return DiagonalGate(instruction), instruction.qubits
+    if instruction.name == "swap":
+        return SwapGate(instruction), instruction.qubits
+    if instruction.name == "ccx":
+        return Toffolie(instruction, None), instruction.qubits
+    if instruction.num_controls:
+        return Controlled2By2Gate(instruction, None), (instruction.controls, instruction.targets[0])
+    if len(instruction.qubits) == 1:
+        return SingelletonGate(instruction), instruction.qubits
+    if len(instruction.qubits) == 2:
+        return ControlledGate(instruction), instruction.qubits
+    return MultiQubitGate(instruction), instruction.qubits
+
+
+def remap_instruction(instruction, mapping):
+    """
+    Copy of an instruction acting on mapping[q] for every qubit q it touches.
+    """
+    return Instruction(
+        instruction.matrix,
+        instruction.name,
+        [mapping[qubit] for qubit in instruction.qubits],
+        instruction.params,
+        instruction.num_controls,
+    )
+
+
+def block_unitary(instructions, qubits):
+    """
+    Dense unitary of a run of instructions restricted to the given qubits, with
+    qubits[0] as the most significant bit of the matrix index.
+    """
+    local = {qubit: len(qubits) - 1 - position for position, qubit in enumerate(qubits)}
+    dim = 2 ** len(qubits)
+    unitary = np.eye(dim, dtype=complex)
+    for col in range(dim):
+        column = unitary[:, col].copy()
+        for instruction in instructions:
+            gate, args = instruction_gate(remap_instruction(instruction, local))
+            column = gate.apply(column, *args)
+        unitary[:, col] = column
+    return unitary
+
+
+def _emit_block(block, out):
+    qubits, instructions = block
+    if len(instructions) == 1:
+        out.append(instructions[0])
+        return
+    if len(qubits) == 1:
+        matrix = instructions[0].matrix
+        for instruction in instructions[1:]:
+            matrix = instruction.matrix @ matrix
+    else:
+        matrix = block_unitary(instructions, qubits)
+    if is_diagonal(matrix):
+        out.append(Instruction(np.diagonal(matrix).copy(), "diagonal", qubits))
+    else:
+        out.append(Instruction(matrix, "fused", qubits))
+
+
+def _is_diagonal_instruction(instruction):
+    if instruction.name == "diagonal":
+        return True
+    return instruction.matrix is not None and np.ndim(instruction.matrix) == 2 and is_diagonal(instruction.matrix)
+
+
+def instruction_diagonal(instruction):
+    """
+    Diagonal of a diagonal instruction over its own qubits, indexed with
+    instruction.qubits[0] as the most significant bit.
+    """
+    if instruction.name == "diagonal":
+        return np.asarray(instruction.matrix)
+    if instruction.num_controls:
+        diagonal = np.ones(2 ** len(instruction.qubits), dtype=complex)
+        diagonal[-2:] = np.diagonal(instruction.matrix)
+        return diagonal
+    return np.diagonal(instruction.matrix)
+
+
+def _emit_diagonal_block(qubits, instructions, out):
+    if len(instructions) == 1:
+        out.append(instructions[0])
+        return
+    index = np.arange(2 ** len(qubits))
+    local = {qubit: len(qubits) - 1 - position for position, qubit in enumerate(qubits)}
+    diagonal = np.ones(2 ** len(qubits), dtype=complex)
+    for instruction in instructions:
+        sub_index = np.zeros_like(index)
+        for qubit in instruction.qubits:
+            sub_index = (sub_index << 1) | ((index >> local[qubit]) & 1)
+        diagonal *= instruction_diagonal(instruction)[sub_index]
+    out.append(Instruction(diagonal, "diagonal", qubits))
+
+
+def merge_diagonals(instructions, max_width=DIAGONAL_BLOCK_WIDTH):
+    """
+    Accumulates diagonal gates (z, s, t, p, rz, u1, cz, cp, ...) into one phase
+    vector over the union of their qubits, applied in a single pass. Diagonal gates
+    commute with each other, and a non-diagonal gate on other qubits is moved in
+    front of the open block, so only a gate touching the block's qubits ends it.
+    ...
+    Args:
+        instructions: Sequence of Instruction objects in circuit order.
+        max_width: Largest number of qubits one phase vector may span.
+    """
+    out = []
+    qubits, block = [], []
+    for instruction in instructions:
+        if _is_diagonal_instruction(instruction):
+            support = list(dict.fromkeys(qubits + list(instruction.qubits)))
+            if len(support) > max_width:
+                _emit_diagonal_block(qubits, block, out)
+                support, block = list(instruction.qubits), []
+            qubits = support
+            block.append(instruction)
+            continue
+        if block and set(instruction.qubits) & set(qubits):
+            _emit_diagonal_block(qubits, block, out)
+            qubits, block = [], []
+        out.append(instruction)
+    if block:
+        _emit_diagonal_block(qubits, block, out)
+    return out
+
+
+def fuse_gates(instructions, max_width=2):
+    """
+    Gate-fusion pass. Consecutive gates whose combined support stays within
+    max_width qubits are multiplied into one dense block, so a run of rotations on
+    one wire becomes a single 2x2 and neighbouring 1- and 2-qubit gates become one
+    4x4 (for max_width=2). Instructions without a matrix act as barriers.
+    ...
+    Args:
+        instructions: Sequence of Instruction objects in circuit order.
+        max_width: Largest number of qubits a fused block may span.
+    Returns:
+        The fused instruction list and the number of gates that were fused away.
+    """
+    out = []
+    open_blocks = {}
+    for instruction in instructions:
+        qubits = list(instruction.qubits)
+        touched = []
+        for qubit in qubits:
+            block = open_blocks.get(qubit)
+            if block is not None and all(block is not other for other in touched):
+                touched.append(block)
+        support = list(dict.fromkeys([q for block in touched for q in block[0]] + qubits))
+
+        fusable = instruction.matrix is not None and np.ndim(instruction.matrix) == 2
+        if fusable and len(support) <= max_width:
+            merged = (support, [inst for block in touched for inst in block[1]] + [instruction])
+            for qubit in support:
+                open_blocks[qubit] = merged
+            continue
+
+        for block in touched:
+            _emit_block(block, out)
+            for qubit in block[0]:
+                del open_blocks[qubit]
+        if fusable and len(qubits) <= max_width:
+            block = (qubits, [instruction])
+            for qubit in qubits:
+                open_blocks[qubit] = block
+        else:
+            out.append(instruction)
+
+    emitted = []
+    for block in open_blocks.values():
+        if all(block is not other for other in emitted):
+            emitted.append(block)
+            _emit_block(block, out)
+    return out, len(instructions) - len(out)
+
+
+class ExecutionPlan:
+    """
+    A compiled circuit: the gate objects and their qubit arguments are bound once,
+    so running the plan is a flat loop of kernel calls on the state.
+    """
+
+    def __init__(self, num_qubits, steps, num_fused=0, instructions=None, source=None):
+        self.num_qubits = num_qubits
+        self.steps = steps
+        self.instructions = instructions
+        # The circuit's own instructions, for backends that do not want fused blocks
+        self.source = source
+        self.num_fused = num_fused
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self, state, rng=None):
+        # Outcomes of the mid-circuit measurements, in order, are kept in self.outcomes
+        rng = np.random.default_rng(rng)
+        self.outcomes = []
+        for apply, args in self.steps:
+            if apply is measure_qubit:
+                self.outcomes.append(measure_qubit(state, args[0], rng, args[1]))
+            else:
+                state = apply(state, *args)
+        return state
+
+
+def measured_outcome(instruction):
+    # The recorded outcome of an eager measurement, None when it is still to be drawn
+    return instruction.params[0] if instruction.params else None
+
+
+def _channel_step(state, *qubits):
+    raise ValueError("Kraus channels need the density-matrix backend")
+
+
+def compile_circuit(instructions, num_qubits, fusion_width=2, dtype=None):
+    source = list(instructions)
+    num_fused = 0
+    instructions = merge_diagonals(instructions)
+    if fusion_width:
+        instructions, num_fused = fuse_gates(instructions, fusion_width)
+    steps = []
+    compiled = []
+    for instruction in instructions:
+        if dtype is not None and instruction.matrix is not None and instruction.matrix.dtype != dtype:
+            # Fused blocks and phase vectors are built in double precision
+            instruction = Instruction(
+                instruction.matrix.astype(dtype),
+                instruction.name,
+                instruction.qubits,
+                instruction.params,
+                instruction.num_controls,
+            )
+        if instruction.name == "measure":
+            steps.append((measure_qubit, (instruction.qubits[0], measured_outcome(instruction))))
+        elif instruction.name == "kraus":
+            # Only backends that run plan.instructions themselves can apply channels
+            steps.append((_channel_step, instruction.qubits))
+        else:
+            gate, args = instruction_gate(instruction)
+            steps.append((gate.apply, args))
+        compiled.append(instruction)
+    return ExecutionPlan(num_qubits, steps, num_fused, compiled, source)
@@ -1,5 +1,6 @@
 from qsm.gate_library.gate import *
 from qsm.gate_library.controlled_gate import *
 from qsm.gate_library.gate_matrix import *
+from qsm.gate_library.gate_cache import *
 from qsm.gate_library.controller_meth import *
 from qsm.gate_library.controlled_controlled_gate import *
\ No newline at end of file
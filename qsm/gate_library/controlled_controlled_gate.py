@@ -2,6 +2,7 @@ import numpy as np
 
 from qsm.gate_library.gate_matrix import *
 from qsm.utils import *
+from qsm.kernels import apply_controlled_x
 
 
 class Toffolie:
@@ -10,6 +11,4 @@ class Toffolie:
         self.controller = methcontrol
 
     def apply(self, state, control_qubit1, control_qubit2, target_qubit):
-        mat = Toffoli(int(np.log2(len(state))), control_qubit1, control_qubit2, target_qubit)
-        print(mat)
-        return np.dot(mat, state)
+        return apply_controlled_x(state, [control_qubit1, control_qubit2], target_qubit)
@@ -1,5 +1,6 @@
 import numpy as np
 from qsm.gate_library.gate_matrix import *
+from qsm.kernels import apply_single_qubit_gate, apply_multi_qubit_gate, apply_diagonal_gate
 
 class Gate:
     def __init__(self, instruction):
@@ -14,11 +15,20 @@ class SingelletonGate(Gate):
         super().__init__(instruction)
 
     def apply(self, state, target_qubit):
-        size = int(np.log2(len(state)))
-        mat = self.inst.matrix
-        ket_zero = [identity()] * size
-        ket_zero[target_qubit] = mat
-        operator = ket_zero[0]
-        for i in ket_zero[1:]:
-            operator = np.kron(i, operator)
-        return operator @ state
\ No newline at end of file
+        return apply_single_qubit_gate(state, self.inst.matrix, target_qubit)
+
+
+class MultiQubitGate(Gate):
+    def __init__(self, instruction):
+        super().__init__(instruction)
+
+    def apply(self, state, *qubits):
+        return apply_multi_qubit_gate(state, self.inst.matrix, qubits)
+
+
+class DiagonalGate(Gate):
+    def __init__(self, instruction):
+        super().__init__(instruction)
+
+    def apply(self, state, *qubits):
+        return apply_diagonal_gate(state, self.inst.matrix, qubits)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+
+
+class GateCache:
+    """
+    Bounded LRU cache of gate matrices shared by every circuit. Entries are keyed
+    by gate name and parameters rounded to `decimals` places, and are stored as
+    read-only arrays so a cached matrix can never be modified by a caller.
+    """
+
+    def __init__(self, maxsize=1024, decimals=12):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, name, args, kwargs):
+        if args:
+            args = tuple(round(float(arg), self.decimals) for arg in args)
+        if kwargs:
+            kwargs = tuple(sorted((key, round(float(value), self.decimals)) for key, value in kwargs.items()))
+        else:
+            kwargs = ()
+        return name, args, kwargs
+
+    def get(self, name, args, kwargs, build):
+        if self.maxsize == 0:
+            self.misses += 1
+            return build()
+        key = self._key(name, args, kwargs)
+        with self._lock:
+            matrix = self._entries.get(key)
+            if matrix is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return matrix
+            self.misses += 1
+        matrix = build()
+        matrix.setflags(write=False)
+        with self._lock:
+            self._entries[key] = matrix
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return matrix
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+gate_cache = GateCache()
+
+_SCALARS = (int, float, np.number)
+
+
+def cached_gate(function):
+    """
+    Serves the matrices of a gate_matrix function from the shared gate cache.
+    Calls with array-valued parameters bypass the cache.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        # Plain numbers take the fast path; anything else is checked for array values
+        if not all(isinstance(arg, _SCALARS) for arg in args) or kwargs:
+            if any(np.ndim(arg) for arg in args) or any(np.ndim(value) for value in kwargs.values()):
+                return function(*args, **kwargs)
+        return gate_cache.get(function.__name__, args, kwargs, lambda: function(*args, **kwargs))
+
+    return wrapper
+
+
+def set_gate_cache_size(maxsize):
+    """
+    Sets how many gate matrices the shared cache keeps; 0 disables caching.
+    """
+    gate_cache.resize(maxsize)
+
+
+def gate_cache_info():
+    return gate_cache.info()
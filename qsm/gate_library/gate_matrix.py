@@ -1,5 +1,7 @@
 import numpy as np
 
+from qsm.gate_library.gate_cache import cached_gate
+
 """
 Identity:
     Confirms the state of a qubit as well as used in expanding other gates to then be applied to a specific qubit within a quantum circuit.
@@ -53,6 +55,19 @@ U Gate:
 """
 
 
+def _matrix(rows):
+    """
+    Builds a gate matrix from its entries. When some entries are arrays of angles
+    the result is a stacked (batch, 2, 2) matrix holding one gate per angle.
+    """
+    entries = [np.asarray(entry) for row in rows for entry in row]
+    if not any(entry.ndim for entry in entries):
+        return np.array(rows, "D")
+    entries = np.broadcast_arrays(*entries)
+    return np.stack(entries, axis=-1).reshape(entries[0].shape + (len(rows), len(rows[0]))).astype("D")
+
+
+@cached_gate
 def identity():
     """
     Confirms the state of a qubit as well as used in expanding other gates to then be applied to a specific qubit within a quantum circuit.
@@ -60,9 +75,10 @@ def identity():
         I = [1, 0]
             [0, 1]
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 1 + 0j]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 1 + 0j]], "D")
 
 
+@cached_gate
 def paulix():
     """
     Switches the amplitude of the amplitudes of the states of |0> and |1>.
@@ -70,9 +86,10 @@ def paulix():
         X = [0, 1]
             [1, 0]
     """
-    return np.array([[0 + 0j, 1 + 0j], [1 + 0j, 0 + 0j]], "F")
+    return np.array([[0 + 0j, 1 + 0j], [1 + 0j, 0 + 0j]], "D")
 
 
+@cached_gate
 def pauliy():
     """
     Changes the state of the qubit by pi around the y-axis of a Bloch Sphere.
@@ -80,9 +97,10 @@ def pauliy():
         Y = [0, -i]
             [i,  0]
     """
-    return np.array([[0 + 0j, 0 - 1j], [0 + 1j, 0 + 0j]], "F")
+    return np.array([[0 + 0j, 0 - 1j], [0 + 1j, 0 + 0j]], "D")
 
 
+@cached_gate
 def pauliz():
     """
     Changes the state of the qubit by pi around the y-axis of a Bloch Sphere.
@@ -90,9 +108,10 @@ def pauliz():
         Z = [1,  0]
             [0, -1]
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, -1 + 0j]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, -1 + 0j]], "D")
 
 
+@cached_gate
 def hadamard():
     """
     Hadamard gate puts the qubit that this gate has been enacted on into a
@@ -101,9 +120,10 @@ def hadamard():
         Hadamard = [1,  1]
                    [1, -1] * (1/sqrt(2))
     """
-    return np.array([[1 + 0j, 1 + 0j], [1 + 0j, -1 + 0j]], "F") * (1 / np.sqrt(2))
+    return np.array([[1 + 0j, 1 + 0j], [1 + 0j, -1 + 0j]], "D") * (1 / np.sqrt(2))
 
 
+@cached_gate
 def phase(theta: float = np.pi / 2):
     """
     Phase gate will rotate the qubit's amplitude based off of the value of theta.
@@ -115,9 +135,10 @@ def phase(theta: float = np.pi / 2):
         theta: Initially set to pi / 2, can be inputted to change how this
         gate will shift the qubits position.
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, np.exp(0 + 1j * theta)]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, np.exp(0 + 1j * theta)]], "D")
 
 
+@cached_gate
 def s():
     """
     S gate is the equivalent to a pi / 2 rotation around the z axis for a qubit.
@@ -125,9 +146,10 @@ def s():
         S = [1, 0]
             [0, i]
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 0 + 1j]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 0 + 1j]], "D")
 
 
+@cached_gate
 def sdg():
     """
     SDG gate is the inverse of the S gate and will change the
@@ -136,9 +158,10 @@ def sdg():
         SDG = [1, 0]
               [0, -i]
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 0 - 1j]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, 0 - 1j]], "D")
 
 
+@cached_gate
 def t():
     """
     T gate is a special use case gate that in implemented from the P Gate.
@@ -146,9 +169,10 @@ def t():
         T = [1, 0]
             [0, e^((i * pi) / 4]
     """
-    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, np.exp((0 + 1j * np.pi) / 4)]], "F")
+    return np.array([[1 + 0j, 0 + 0j], [0 + 0j, np.exp((0 + 1j * np.pi) / 4)]], "D")
 
 
+@cached_gate
 def tdg():
     """
     TDG gate is the inverse of the T Gate that will impose the opposite rotation
@@ -160,6 +184,7 @@ def tdg():
     return t().conj().T
 
 
+@cached_gate
 def rz(theta: float = np.pi / 2):
     """
     RZ gate commits a rotation around the z-axis for a qubit.
@@ -169,11 +194,13 @@ def rz(theta: float = np.pi / 2):
     ...
     Args:
         theta: Initially set to pi / 2, can be inputted to change how this gate \
-        will shift the qubits position.
+        will shift the qubits position. An array of angles gives a stacked
+        (batch, 2, 2) matrix.
     """
-    return np.array([[np.exp((0 - 1j * (theta / 2))), 0 + 0j], [0 + 0j, np.exp(0 + 1j * (theta / 2))]], "F")
+    return _matrix([[np.exp((0 - 1j * (theta / 2))), 0 + 0j], [0 + 0j, np.exp(0 + 1j * (theta / 2))]])
 
 
+@cached_gate
 def rx(theta: float = np.pi / 2):
     """
     RX gate commits a rotaiton around the x-axis for a given qubit.
@@ -183,13 +210,15 @@ def rx(theta: float = np.pi / 2):
     ...
     Args:
         theta: Initially set to pi / 2, can be inputted to change how this gate
-        will shift the qubits position.
+        will shift the qubits position. An array of angles gives a stacked
+        (batch, 2, 2) matrix.
     """
-    return np.array(
-        [[np.cos(theta / 2), 0 - 1j * np.sin(theta / 2)], [0 - 1j * np.sin(theta / 2), np.cos(theta / 2)]], "F"
+    return _matrix(
+        [[np.cos(theta / 2), 0 - 1j * np.sin(theta / 2)], [0 - 1j * np.sin(theta / 2), np.cos(theta / 2)]]
     )
 
 
+@cached_gate
 def ry(theta: float = np.pi / 2):
     """
     RY gate commits a rotaiton around the y-axis for a given qubit.
@@ -199,11 +228,13 @@ def ry(theta: float = np.pi / 2):
     ...
     Args:
         theta: Initially set to pi / 2, can be inputted to change how this gate
-        will shift the qubits position.
+        will shift the qubits position. An array of angles gives a stacked
+        (batch, 2, 2) matrix.
     """
-    return np.array([[np.cos(theta / 2), -1 * np.sin(theta / 2)], [np.sin(theta / 2), np.cos(theta / 2)]], "F")
+    return _matrix([[np.cos(theta / 2), -1 * np.sin(theta / 2)], [np.sin(theta / 2), np.cos(theta / 2)]])
 
 
+@cached_gate
 def sx():
     """
     SX gate in other terms is called a "square root of X (Inverse) gate"
@@ -213,9 +244,10 @@ def sx():
         SX = [1 + i, 1 - i]
              [1 - i, 1 + i] * (1 / 2)
     """
-    return np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]], "F") * (1 / 2)
+    return np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]], "D") * (1 / 2)
 
 
+@cached_gate
 def sxdg():
     """
     SXDG gate is the inverse of the SX gate and will inact the same logic
@@ -224,9 +256,10 @@ def sxdg():
         SXDG = [1 - i, 1 + i]
                [1 + i, 1 - i] * (1 / 2)
     """
-    return np.array([[1 - 1j, 1 + 1j], [1 + 1j, 1 - 1j]], "F") * (1 / 2)
+    return np.array([[1 - 1j, 1 + 1j], [1 + 1j, 1 - 1j]], "D") * (1 / 2)
 
 
+@cached_gate
 def u(theta: float = np.pi / 2, phi: float = np.pi / 2, lmbda: float = np.pi / 2):
     """
     U gate is given three inputs (theta, phi, and lambda) that allow the inputs
@@ -240,13 +273,13 @@ def u(theta: float = np.pi / 2, phi: float = np.pi / 2, lmbda: float = np.pi / 2
         theta: Initially set to pi / 2, can be inputted to change how this gate will shift the qubits position.
         phi: Initially set to pi / 2, can be inputted to change how this gate will shift the qubits position.
         lmbda: Initially set to pi / 2, can be inputted to change how this gate will shift the qubits position.
+        Any of the three may be an array of angles, giving a stacked (batch, 2, 2) matrix.
     """
-    return np.array(
+    return _matrix(
         [
             [np.cos(theta / 2), -1 * np.exp(0 + 1j * lmbda) * np.sin(theta / 2)],
             [np.exp(0 + 1j * phi) * np.sin(theta / 2), np.exp(0 + 1j * (lmbda + phi)) * np.cos(theta / 2)],
-        ],
-        "F",
+        ]
     )
 
 
@@ -276,6 +309,7 @@ CZ Gate:
 """
 
 
+@cached_gate
 def cnot(little_endian: bool = False):
     """
     CNOT Gate allows for two qubits to be entangled with each other if the
@@ -301,7 +335,7 @@ def cnot(little_endian: bool = False):
                 [0 + 0j, 0 + 0j, 1 + 0j, 0 + 0j],
                 [0 + 0j, 1 + 0j, 0 + 0j, 0 + 0j],
             ],
-            "F",
+            "D",
         )
     else:
         return np.array(
@@ -311,10 +345,11 @@ def cnot(little_endian: bool = False):
                 [0 + 0j, 0 + 0j, 0 + 0j, 1 + 0j],
                 [0 + 0j, 0 + 0j, 1 + 0j, 0 + 0j],
             ],
-            "F",
+            "D",
         )
 
 
+@cached_gate
 def swap():
     """
     SWAP Gate allows for two qubits to swap its values and properties.
@@ -333,10 +368,11 @@ def swap():
             [0 + 0j, 1 + 0j, 0 + 0j, 0 + 0j],
             [0 + 0j, 0 + 0j, 0 + 0j, 1 + 0j],
         ],
-        "F",
+        "D",
     )
 
 
+@cached_gate
 def toffoli():
     """
     Toffoli Gate (CCX) acts similar in nature to the CNOT gate and will entangle
@@ -365,10 +401,11 @@ def toffoli():
             [0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 1 + 0j],
             [0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 0 + 0j, 1 + 0j, 0 + 0j],
         ],
-        "F",
+        "D",
     )
 
 
+@cached_gate
 def rxx(theta: float = np.pi / 2):
     """
     RXX gate is a 2-qubit gate that will rotate both of the qubits around the
@@ -390,10 +427,11 @@ def rxx(theta: float = np.pi / 2):
             [0 + 0j, 0 - 1j * np.sin(theta / 2), np.cos(theta / 2), 0 + 0j],
             [0 - 1j * np.sin(theta / 2), 0 + 0j, 0 + 0j, np.cos(theta / 2)],
         ],
-        "F",
+        "D",
     )
 
 
+@cached_gate
 def rzz(theta: float = np.pi / 2):
     """
     RZZ gate is a 2-qubit gate that will rotate both of the qubits around the
@@ -415,10 +453,11 @@ def rzz(theta: float = np.pi / 2):
             [0 + 0j, 0 + 0j, np.exp(0 + 1j * (theta / 2)), 0 + 0j],
             [0 + 0j, 0 + 0j, 0 + 0j, np.exp(0 - 1j * (theta / 2))],
         ],
-        "F",
+        "D",
     )
 
 
+@cached_gate
 def cr(theta: float = np.pi / 2):
     """
     CR gate is a controlled phase shift roatation gate that applies to 2-qubits.
@@ -437,12 +476,13 @@ def cr(theta: float = np.pi / 2):
             [1 + 0j, 0 + 0j, 0 + 0j, 0 + 0j],
             [0 + 0j, 1 + 0j, 0 + 0j, 0 + 0j],
             [0 + 0j, 0 + 0j, 1 + 0j, 0 + 0j],
-            [0 + 0j, 0 + 0j, 0 + 0j, np.exp(theta * 0 + 1j)],
+            [0 + 0j, 0 + 0j, 0 + 0j, np.exp(0 + 1j * theta)],
         ],
-        "F",
+        "D",
     )
 
 
+@cached_gate
 def cz():
     """
     CZ gate is a controlled phase shift roatation gate that applies to 2-qubits.
@@ -459,17 +499,24 @@ def cz():
             [0 + 0j, 0 + 0j, 1 + 0j, 0 + 0j],
             [0 + 0j, 0 + 0j, 0 + 0j, -1 + 0j],
         ],
-        "F",
+        "D",
     )
 
 
-def Toffoli(n, a, b, x):
+def toffoli_permutation(n, a, b, x):
+    """
+    Basis permutation of the Toffoli gate on an n qubit register: entry i is the
+    index that |i> is sent to. Qubits a, b and x are counted from 1 starting at the
+    most significant bit, as in Toffoli().
+    """
     m = 2 ** (n - a) + 2 ** (n - b)
-    d = lambda i: 2 ** (n - x) if (2 ** (n - x)) & i == 0 else -(2 ** (n - x))
-    T = np.array([([0] * 2 ** n)] * 2 ** n)
-    for i in range(2 ** n):
-        for j in range(2 ** n):
-            T[i][j] = 1 if (i & m == m and j == d(i) + i) or (i & m != m and j == i) else 0
+    i = np.arange(2 ** n)
+    return np.where(i & m == m, i ^ (2 ** (n - x)), i)
+
+
+def Toffoli(n, a, b, x):
+    T = np.zeros((2 ** n, 2 ** n), dtype=int)
+    T[np.arange(2 ** n), toffoli_permutation(n, a, b, x)] = 1
     return T
 
 
@@ -0,0 +1,128 @@
+import numpy as np
+
+from qsm.instruction import Instruction
+from qsm.compiler import compile_circuit, instruction_gate
+from qsm.observables import apply_observable, expectation_value
+from qsm.gate_library.gate_matrix import rx, ry, rz, u
+
+# Gates whose angles are differentiated, with the gate_matrix function that builds them from their params
+ROTATIONS = {"rx": rx, "ry": ry, "rz": rz, "u3": u}
+
+_EXCITED = np.array([[0, 0], [0, 1]], dtype=complex)
+
+
+def rotation_parameters(instructions):
+    """
+    (instruction index, param index) of every differentiable angle, in circuit
+    order; gradients are returned in this order. Angles of other gates (p, u1,
+    cp, ...) are treated as constants.
+    """
+    return [
+        (position, index)
+        for position, instruction in enumerate(instructions)
+        if instruction.name in ROTATIONS
+        for index in range(len(instruction.params))
+    ]
+
+
+def rotation_derivatives(instruction):
+    """
+    dU/dangle for each param of a rotation, from the gate_matrix functions:
+    R(theta + pi) / 2 for rx, ry and rz, and for u3 u(theta + pi, phi, lambda) / 2,
+    i |1><1| U and i U |1><1|.
+    """
+    build = ROTATIONS[instruction.name]
+    if instruction.name != "u3":
+        return [build(instruction.params[0] + np.pi) / 2]
+    theta, phi, lmbda = instruction.params
+    matrix = u(theta, phi, lmbda)
+    return [u(theta + np.pi, phi, lmbda) / 2, 1j * _EXCITED @ matrix, 1j * matrix @ _EXCITED]
+
+
+def _check_unitary(instructions):
+    for instruction in instructions:
+        if instruction.name in ("measure", "kraus"):
+            raise ValueError("Gradients need a circuit made of gates, not {!r}".format(instruction.name))
+        if any(np.ndim(param) for param in instruction.params):
+            raise ValueError("Gradients are taken of unbatched circuits")
+
+
+def _apply(state, instruction, matrix):
+    gate, args = instruction_gate(Instruction(matrix, instruction.name, instruction.qubits, instruction.params, instruction.num_controls))
+    return gate.apply(state, *args)
+
+
+def adjoint_gradient(instructions, num_qubits, observable, dtype=np.complex128, fusion_width=2):
+    """
+    <H> and its gradient with respect to every rotation angle by the adjoint
+    method: one forward run, then one backward sweep that un-applies the gates
+    from the end, carrying both |phi> = U_k...U_1|0> and |lambda> = U_{k+1}^dagger
+    ... U_N^dagger H|psi>. At a rotation, d<H>/dangle = 2 Re <lambda| dU_k |phi_{k-1}>.
+    Three state vectors are kept, so memory stays O(2^n), and the time is that of
+    about three forward runs plus one gate per angle.
+    ...
+    Args:
+        instructions: The circuit's instructions, gates only.
+        num_qubits: Width of the register.
+        observable: Weighted Pauli strings, as for expectation_value.
+    Returns:
+        The expectation value and an array of d<H>/dangle in the order of
+        rotation_parameters(instructions).
+    """
+    instructions = list(instructions)
+    _check_unitary(instructions)
+    state = np.zeros(2 ** num_qubits, dtype=dtype)
+    state[0] = 1
+    phi = compile_circuit(instructions, num_qubits, fusion_width, dtype).run(state)
+    value = expectation_value(phi, observable)
+    lam = apply_observable(phi, observable).astype(dtype)
+    gradient = np.zeros(len(rotation_parameters(instructions)))
+    slot = len(gradient)
+    for instruction in reversed(instructions):
+        inverse = np.conj(np.swapaxes(instruction.matrix, -1, -2))
+        phi = _apply(phi, instruction, inverse)
+        if instruction.name in ROTATIONS:
+            derivatives = rotation_derivatives(instruction)
+            slot -= len(derivatives)
+            for index, derivative in enumerate(derivatives):
+                moved = _apply(phi.copy(), instruction, derivative.astype(dtype))
+                gradient[slot + index] = 2 * np.real(np.vdot(lam, moved))
+        lam = _apply(lam, instruction, inverse)
+    return value, gradient
+
+
+def parameter_shift_gradient(instructions, num_qubits, observable, dtype=np.complex128, fusion_width=2, max_batch=8):
+    """
+    The gradient of <H> by the parameter-shift rule, d<H>/dangle =
+    (<H>(angle + pi/2) - <H>(angle - pi/2)) / 2, which holds for every rx, ry, rz
+    and u3 angle. The shifted circuits are not built one by one: each angle owns
+    two rows of a batched state, and the rotations get one angle per row, so up
+    to max_batch shifted circuits run together as one batched simulation.
+    """
+    instructions = list(instructions)
+    _check_unitary(instructions)
+    parameters = rotation_parameters(instructions)
+    gradient = np.zeros(len(parameters))
+    per_run = max(max_batch // 2, 1)
+    for start in range(0, len(parameters), per_run):
+        chunk = parameters[start:start + per_run]
+        shifts = {}
+        for row, (position, index) in enumerate(chunk):
+            shifts.setdefault(position, []).append((row, index))
+        batched = []
+        for position, instruction in enumerate(instructions):
+            if position not in shifts:
+                batched.append(instruction)
+                continue
+            params = [np.full(2 * len(chunk), param, dtype=float) for param in instruction.params]
+            for row, index in shifts[position]:
+                params[index][2 * row] += np.pi / 2
+                params[index][2 * row + 1] -= np.pi / 2
+            matrix = ROTATIONS[instruction.name](*params)
+            batched.append(Instruction(matrix, instruction.name, instruction.qubits, tuple(params)))
+        state = np.zeros((2 * len(chunk), 2 ** num_qubits), dtype=dtype)
+        state[:, 0] = 1
+        state = compile_circuit(batched, num_qubits, fusion_width, dtype).run(state)
+        values = expectation_value(state, observable)
+        gradient[start:start + len(chunk)] = (values[0::2] - values[1::2]) / 2
+    return gradient
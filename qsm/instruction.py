@@ -1,5 +1,20 @@
 import numpy as np
 
 class Instruction:
-    def __init__(self, matrix):
-        self.matrix = matrix
\ No newline at end of file
+    def __init__(self, matrix, name="custom", qubits=(), params=(), num_controls=0):
+        self.matrix = matrix
+        self.name = name
+        self.qubits = tuple(qubits)
+        self.params = tuple(params)
+        self.num_controls = num_controls
+
+    @property
+    def controls(self):
+        return self.qubits[:self.num_controls]
+
+    @property
+    def targets(self):
+        return self.qubits[self.num_controls:]
+
+    def __repr__(self):
+        return "Instruction({!r}, qubits={}, params={})".format(self.name, self.qubits, self.params)
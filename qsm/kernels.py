@@ -0,0 +1,416 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+"""
+State-vector kernels:
+    The kernels below act directly on a state vector of 2^n amplitudes instead of
+    building the full 2^n x 2^n operator. Qubit k is bit k of the amplitude index
+    (qubit 0 is the least significant bit), the same ordering that the Kronecker
+    expansion of the gate library produces.
+
+    A state may carry leading batch axes, e.g. (batch, 2^n), in which case every
+    row is an independent register. Single-qubit matrices may likewise be stacked
+    as (batch, 2, 2) to apply a different matrix to every row.
+
+    Large states are split into independent index blocks, one per worker thread,
+    along the axes that the gate does not touch. The NumPy ufuncs doing the work
+    release the GIL, so the blocks are processed concurrently.
+"""
+
+_threading = {"workers": 1, "threshold": 2 ** 20, "executor": None}
+_threading_lock = threading.Lock()
+
+
+def set_num_threads(workers, threshold=None):
+    """
+    Sets how many threads the kernels use on large states.
+    ...
+    Args:
+        workers: Number of worker threads, 1 keeps every kernel single-threaded.
+        threshold: Number of amplitudes below which a kernel stays
+        single-threaded; unchanged when None.
+    """
+    with _threading_lock:
+        if _threading["executor"] is not None:
+            _threading["executor"].shutdown()
+        _threading["workers"] = max(1, int(workers))
+        _threading["executor"] = None
+        if threshold is not None:
+            _threading["threshold"] = threshold
+
+
+def get_num_threads():
+    return _threading["workers"]
+
+
+def _executor():
+    with _threading_lock:
+        if _threading["executor"] is None:
+            _threading["executor"] = ThreadPoolExecutor(_threading["workers"])
+        return _threading["executor"]
+
+
+def _blocks(shape, axes, workers):
+    # Index tuples that cut an array into about `workers` blocks along `axes`
+    splits = []
+    count = 1
+    for axis in axes:
+        if count >= workers:
+            break
+        parts = min(shape[axis], -(-workers // count))
+        if parts > 1:
+            edges = np.linspace(0, shape[axis], parts + 1).astype(int)
+            splits.append((axis, [slice(lo, hi) for lo, hi in zip(edges[:-1], edges[1:])]))
+            count *= parts
+    for combo in itertools.product(*[slices for _, slices in splits]):
+        index = [slice(None)] * len(shape)
+        for (axis, _), part in zip(splits, combo):
+            index[axis] = part
+        yield tuple(index)
+
+
+def _in_blocks(view, touched_axes, batch_ndim, function, *args):
+    # Runs function(block, *args) over independent blocks of `view`. Blocks are cut
+    # along axes the gate does not touch, skipping the first `batch_ndim` axes when
+    # the gate holds one matrix per batch row.
+    workers = _threading["workers"]
+    if workers > 1 and view.size >= _threading["threshold"]:
+        touched = {axis % view.ndim for axis in touched_axes}
+        free = [axis for axis in range(batch_ndim, view.ndim) if axis not in touched]
+        free.sort(key=lambda axis: -view.shape[axis])
+        blocks = list(_blocks(view.shape, free, workers))
+        if len(blocks) > 1:
+            for future in [_executor().submit(function, view[index], *args) for index in blocks]:
+                future.result()
+            return
+    function(view, *args)
+
+
+def num_qubits_of(state):
+    return int(np.log2(state.shape[-1]))
+
+
+def _is_pauli_x(matrix):
+    return np.ndim(matrix) == 2 and matrix[0, 0] == 0 and matrix[1, 1] == 0 and matrix[0, 1] == 1 and matrix[1, 0] == 1
+
+
+def is_diagonal(matrix):
+    matrix = np.asarray(matrix)
+    return matrix.ndim == 2 and not np.any(matrix - np.diag(np.diagonal(matrix)))
+
+
+def _batch_ndim(state, matrix):
+    return state.ndim - 1 if np.ndim(matrix) > 2 else 0
+
+
+def _coefficient(matrix, row, col, ndim):
+    # Entry (row, col) of a possibly stacked matrix, shaped to broadcast against
+    # amplitude slices with `ndim` axes whose leading axes are the batch axes.
+    value = matrix[..., row, col]
+    if np.ndim(value) == 0:
+        return value
+    return value.reshape(value.shape + (1,) * (ndim - value.ndim))
+
+
+def _scale(amplitudes, factor):
+    if np.ndim(factor) or factor != 1:
+        amplitudes *= factor
+
+
+def _apply_2x2(amp_zero, amp_one, matrix):
+    ndim = amp_zero.ndim
+    m00, m01 = _coefficient(matrix, 0, 0, ndim), _coefficient(matrix, 0, 1, ndim)
+    m10, m11 = _coefficient(matrix, 1, 0, ndim), _coefficient(matrix, 1, 1, ndim)
+    if not np.any(m01) and not np.any(m10):
+        _scale(amp_zero, m00)
+        _scale(amp_one, m11)
+        return
+    tmp = amp_zero.copy()
+    amp_zero *= m00
+    amp_zero += m01 * amp_one
+    amp_one *= m11
+    amp_one += m10 * tmp
+
+
+def _swap_slices(amp_a, amp_b):
+    tmp = amp_a.copy()
+    amp_a[...] = amp_b
+    amp_b[...] = tmp
+
+
+def _target_view(state, target_qubit):
+    # (..., 2^(n-k-1), 2, 2^k) view whose axis -2 is the target bit
+    return state.reshape(state.shape[:-1] + (-1, 2, 1 << target_qubit))
+
+
+def _single_qubit_block(view, matrix):
+    _apply_2x2(view[..., 0, :], view[..., 1, :], matrix)
+
+
+def apply_single_qubit_gate(state, matrix, target_qubit):
+    """
+    Applies a 2x2 matrix to the target qubit of the state in place.
+    The state is viewed as (2^(n-k-1), 2, 2^k) so that axis 1 is the target bit,
+    and only that axis is contracted. Diagonal matrices only scale the two halves.
+    ...
+    Args:
+        state: Contiguous complex state vector, updated in place.
+        matrix: 2x2 gate matrix, or (batch, 2, 2) for a batched state.
+        target_qubit: Index of the qubit the matrix acts on.
+    """
+    if _is_pauli_x(matrix):
+        return apply_controlled_x(state, [], target_qubit)
+    _in_blocks(_target_view(state, target_qubit), [-2], _batch_ndim(state, matrix), _single_qubit_block, matrix)
+    return state
+
+
+def _tensor(state):
+    return state.reshape(state.shape[:-1] + (2,) * num_qubits_of(state))
+
+
+def _qubit_axes(tensor, qubits):
+    return [tensor.ndim - 1 - qubit for qubit in qubits]
+
+
+def _bit_index(num_qubits, fixed_bits):
+    # Basic-indexing tuple into the (..., 2, ..., 2) tensor view of the state; the
+    # last axis is qubit 0, so qubit q lives on axis -(q + 1). Fixed bits are
+    # length-1 slices so the result stays a view even when every axis is fixed.
+    index = [slice(None)] * num_qubits
+    for qubit, bit in fixed_bits.items():
+        index[num_qubits - 1 - qubit] = slice(bit, bit + 1)
+    return (Ellipsis, *index)
+
+
+def _controlled_block(tensor, matrix, control_qubits, target_qubit, num_qubits):
+    controls = {qubit: 1 for qubit in control_qubits}
+    _apply_2x2(
+        tensor[_bit_index(num_qubits, {**controls, target_qubit: 0})],
+        tensor[_bit_index(num_qubits, {**controls, target_qubit: 1})],
+        matrix,
+    )
+
+
+def apply_controlled_gate(state, matrix, control_qubits, target_qubit):
+    """
+    Applies a 2x2 matrix to the target qubit on the amplitudes where every
+    control qubit is |1>, in place. The two target slices are strided views of
+    the state, so nothing larger than half the state is allocated.
+    ...
+    Args:
+        state: Contiguous complex state vector, updated in place.
+        matrix: 2x2 gate matrix, or (batch, 2, 2) for a batched state.
+        control_qubits: Index, or sequence of indices, of the control qubits.
+        target_qubit: Index of the qubit the matrix acts on.
+    """
+    if np.ndim(control_qubits) == 0:
+        control_qubits = [control_qubits]
+    if len(control_qubits) == 0:
+        return apply_single_qubit_gate(state, matrix, target_qubit)
+    if target_qubit in control_qubits:
+        raise ValueError("The target qubit cannot also be a control qubit")
+
+    if _is_pauli_x(matrix):
+        return apply_controlled_x(state, control_qubits, target_qubit)
+
+    num_qubits = num_qubits_of(state)
+    tensor = _tensor(state)
+    _in_blocks(
+        tensor,
+        _qubit_axes(tensor, [*control_qubits, target_qubit]),
+        _batch_ndim(state, matrix),
+        _controlled_block,
+        matrix,
+        control_qubits,
+        target_qubit,
+        num_qubits,
+    )
+    return state
+
+
+def _controlled_x_block(tensor, control_qubits, target_qubit, num_qubits):
+    controls = {qubit: 1 for qubit in control_qubits}
+    _swap_slices(
+        tensor[_bit_index(num_qubits, {**controls, target_qubit: 0})],
+        tensor[_bit_index(num_qubits, {**controls, target_qubit: 1})],
+    )
+
+
+def _x_block(view):
+    _swap_slices(view[..., 0, :], view[..., 1, :])
+
+
+def apply_controlled_x(state, control_qubits, target_qubit):
+    """
+    Applies X, CX, CCX or any multi-controlled X as a basis permutation: the
+    target slices with every control set are exchanged in place, no arithmetic.
+    ...
+    Args:
+        state: Contiguous state vector, updated in place.
+        control_qubits: Sequence of control qubit indices, may be empty.
+        target_qubit: Index of the flipped qubit.
+    """
+    if len(control_qubits) == 0:
+        _in_blocks(_target_view(state, target_qubit), [-2], 0, _x_block)
+        return state
+    tensor = _tensor(state)
+    _in_blocks(
+        tensor,
+        _qubit_axes(tensor, [*control_qubits, target_qubit]),
+        0,
+        _controlled_x_block,
+        control_qubits,
+        target_qubit,
+        num_qubits_of(state),
+    )
+    return state
+
+
+def _swap_block(tensor, qubit1, qubit2, num_qubits):
+    _swap_slices(
+        tensor[_bit_index(num_qubits, {qubit1: 0, qubit2: 1})],
+        tensor[_bit_index(num_qubits, {qubit1: 1, qubit2: 0})],
+    )
+
+
+def apply_swap(state, qubit1, qubit2):
+    """
+    Exchanges two qubits by swapping the |01> and |10> slices in place.
+    """
+    if qubit1 == qubit2:
+        return state
+    tensor = _tensor(state)
+    _in_blocks(tensor, _qubit_axes(tensor, [qubit1, qubit2]), 0, _swap_block, qubit1, qubit2, num_qubits_of(state))
+    return state
+
+
+def _two_qubit_block(tensor, matrix, qubit1, qubit2, num_qubits):
+    views = [tensor[_bit_index(num_qubits, {qubit1: b1, qubit2: b2})] for b1 in (0, 1) for b2 in (0, 1)]
+    if is_diagonal(matrix):
+        for row, view in enumerate(views):
+            _scale(view, matrix[row, row])
+        return
+    old = [view.copy() for view in views]
+    for row, view in enumerate(views):
+        view[...] = 0
+        for col in range(4):
+            if matrix[row, col] == 1:
+                view += old[col]
+            elif matrix[row, col] != 0:
+                view += matrix[row, col] * old[col]
+
+
+def apply_two_qubit_gate(state, matrix, qubit1, qubit2):
+    """
+    Applies a 4x4 matrix to two qubits in place. Row and column indices of the
+    matrix are 2 * bit(qubit1) + bit(qubit2), so qubit1 is the high bit as in the
+    big endian cnot() and swap() matrices.
+    ...
+    Args:
+        state: Contiguous complex state vector, updated in place.
+        matrix: 4x4 gate matrix.
+        qubit1: Qubit mapped to the high bit of the matrix index.
+        qubit2: Qubit mapped to the low bit of the matrix index.
+    """
+    if qubit1 == qubit2:
+        raise ValueError("A two-qubit gate needs two distinct qubits")
+    tensor = _tensor(state)
+    _in_blocks(
+        tensor, _qubit_axes(tensor, [qubit1, qubit2]), 0, _two_qubit_block, matrix, qubit1, qubit2, num_qubits_of(state)
+    )
+    return state
+
+
+def _multi_qubit_block(tensor, operator, axes):
+    k = len(axes)
+    result = np.tensordot(operator, tensor, axes=(list(range(k, 2 * k)), axes))
+    tensor[...] = np.moveaxis(result, list(range(k)), axes)
+
+
+def apply_multi_qubit_gate(state, matrix, qubits):
+    """
+    Applies a 2^k x 2^k matrix to k qubits. The first qubit is the most significant
+    bit of the matrix index, as in apply_two_qubit_gate. Used for fused blocks.
+    ...
+    Args:
+        state: Contiguous complex state vector, updated in place.
+        matrix: 2^k x 2^k gate matrix.
+        qubits: Sequence of k distinct qubit indices.
+    """
+    k = len(qubits)
+    tensor = _tensor(state)
+    axes = _qubit_axes(tensor, qubits)
+    operator = np.asarray(matrix).reshape((2,) * (2 * k))
+    _in_blocks(tensor, axes, 0, _multi_qubit_block, operator, axes)
+    return state
+
+
+def _diagonal_block(tensor, phases):
+    tensor *= phases
+
+
+def apply_diagonal_gate(state, diagonal, qubits):
+    """
+    Multiplies the state elementwise by a diagonal gate given as its 2^k phase
+    vector. The vector is broadcast over the other qubits, so the whole gate is a
+    single pass over the state.
+    ...
+    Args:
+        state: Contiguous complex state vector, updated in place.
+        diagonal: Diagonal of the gate, indexed with qubits[0] as the most
+        significant bit.
+        qubits: Sequence of k distinct qubit indices.
+    """
+    tensor = _tensor(state)
+    axes = _qubit_axes(tensor, qubits)
+    phases = np.asarray(diagonal).reshape((2,) * len(qubits)).transpose(np.argsort(axes))
+    shape = [2 if axis in axes else 1 for axis in range(tensor.ndim)]
+    _in_blocks(tensor, axes, 0, _diagonal_block, phases.reshape(shape))
+    return state
+
+
+def marginal_probability(state, qubit):
+    """
+    Probability of reading 1 on one qubit, from a single strided reduction over the
+    (..., 2^(n-k-1), 2, 2^k) view; no full probability vector is formed. A batched
+    state gives one value per row.
+    """
+    weights = np.sum(np.abs(_target_view(state, qubit)) ** 2, axis=(-3, -1))
+    return weights[..., 1] / weights.sum(axis=-1)
+
+
+def collapse(state, qubit, outcome, prob):
+    """
+    Projects the state onto `outcome` of one qubit in place and renormalizes by the
+    outcome's probability. outcome and prob may hold one value per batch row.
+    """
+    outcome = np.asarray(outcome)
+    factor = 1 / np.sqrt(prob)
+    keep = np.stack([np.where(outcome == 0, factor, 0), np.where(outcome == 1, factor, 0)], axis=-1)
+    _target_view(state, qubit)[...] *= keep[..., np.newaxis, :, np.newaxis]
+    return state
+
+
+def measure_qubit(state, qubit, rng=None, outcome=None):
+    """
+    Measures one qubit in the Z basis and collapses the state in place.
+    ...
+    Args:
+        state: Contiguous complex state vector, or (batch, 2^n) states.
+        qubit: Qubit to measure.
+        rng: np.random.Generator used to draw the outcome.
+        outcome: Forces this outcome (one per row for a batch) instead of drawing
+        it, e.g. to replay a recorded measurement.
+    """
+    prob_one = marginal_probability(state, qubit)
+    if outcome is None:
+        outcome = (np.random.default_rng(rng).random(np.shape(prob_one)) < prob_one).astype(np.int64)
+    outcome = np.asarray(outcome)
+    prob = np.where(outcome == 1, prob_one, 1 - prob_one)
+    if not np.all(prob > 0):
+        raise ValueError("Outcome {} of qubit {} has probability zero".format(outcome, qubit))
+    collapse(state, qubit, outcome, prob)
+    return int(outcome) if outcome.ndim == 0 else outcome
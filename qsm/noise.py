@@ -0,0 +1,108 @@
+import numpy as np
+
+from qsm.instruction import Instruction
+
+_PAULIS = np.array([[[1, 0], [0, 1]], [[0, 1], [1, 0]], [[0, -1j], [1j, 0]], [[1, 0], [0, -1]]], dtype="D")
+
+
+def depolarizing(p, num_qubits=1):
+    """
+    Kraus operators of the depolarizing channel rho -> (1 - p) rho + p I / d.
+    ...
+    Args:
+        p: Depolarizing probability.
+        num_qubits: Number of qubits the channel acts on, d = 2^num_qubits.
+    """
+    paulis = _PAULIS
+    for _ in range(num_qubits - 1):
+        dim = 2 * paulis.shape[-1]
+        paulis = np.einsum("aij,bkl->abikjl", _PAULIS, paulis).reshape(len(paulis) * 4, dim, dim)
+    weights = np.full(len(paulis), p / len(paulis))
+    weights[0] += 1 - p
+    return np.sqrt(weights)[:, np.newaxis, np.newaxis] * paulis
+
+
+def amplitude_damping(gamma):
+    """
+    Kraus operators of energy relaxation |1> -> |0> with probability gamma.
+    """
+    return np.array([[[1, 0], [0, np.sqrt(1 - gamma)]], [[0, np.sqrt(gamma)], [0, 0]]], dtype="D")
+
+
+def phase_damping(lamba):
+    """
+    Kraus operators of dephasing that shrinks the coherences by sqrt(1 - lamba).
+    """
+    return np.array([[[1, 0], [0, np.sqrt(1 - lamba)]], [[0, 0], [0, np.sqrt(lamba)]]], dtype="D")
+
+
+def readout_error(p0, p1=None):
+    """
+    Confusion matrix of a noisy measurement, entry [measured, actual].
+    ...
+    Args:
+        p0: Probability of reading 1 when the qubit is 0.
+        p1: Probability of reading 0 when the qubit is 1, p0 when None.
+    """
+    p1 = p0 if p1 is None else p1
+    return np.array([[1 - p0, p1], [p0, 1 - p1]])
+
+
+class NoiseModel:
+    """
+    Noise attached to gate names. After every gate whose name has errors, the
+    circuit records one "kraus" instruction per channel: on the gate's qubits when
+    the channel is as wide as the gate, otherwise a single-qubit channel on each of
+    them. Readout errors flip sampled bits and are independent of the backend.
+    """
+
+    def __init__(self):
+        self.gate_errors = {}
+        self.readout_errors = {}
+
+    def add_gate_error(self, kraus, gates=None):
+        """
+        Args:
+            kraus: Stack of Kraus operators, shape (k, 2^m, 2^m).
+            gates: Gate names the channel follows, e.g. ["cx", "h"]; every gate when None.
+        """
+        kraus = np.asarray(kraus, dtype="D")
+        for name in [None] if gates is None else gates:
+            self.gate_errors.setdefault(name, []).append(kraus)
+
+    def add_readout_error(self, confusion, qubits=None):
+        """
+        Args:
+            confusion: 2x2 matrix from readout_error().
+            qubits: Qubits it applies to; every qubit when None.
+        """
+        for qubit in [None] if qubits is None else qubits:
+            self.readout_errors[qubit] = np.asarray(confusion, dtype=np.float64)
+
+    def channels(self, instruction):
+        if instruction.name in ("kraus", "measure"):
+            return []
+        errors = self.gate_errors.get(instruction.name, []) + self.gate_errors.get(None, [])
+        channels = []
+        for kraus in errors:
+            width = int(np.log2(kraus.shape[-1]))
+            if width == len(instruction.qubits):
+                channels.append(Instruction(kraus, "kraus", instruction.qubits))
+            elif width == 1:
+                channels.extend(Instruction(kraus, "kraus", (qubit,)) for qubit in instruction.qubits)
+            else:
+                raise ValueError("A {}-qubit channel cannot follow the {}-qubit gate {}".format(
+                    width, len(instruction.qubits), instruction.name))
+        return channels
+
+    def apply_readout(self, memory, num_qubits, rng):
+        # Flips each sampled bit with the probability its confusion matrix gives
+        memory = np.array(memory)
+        for qubit in range(num_qubits):
+            confusion = self.readout_errors.get(qubit, self.readout_errors.get(None))
+            if confusion is None:
+                continue
+            bits = (memory >> qubit) & 1
+            flip = rng.random(memory.shape) < np.where(bits == 1, confusion[0, 1], confusion[1, 0])
+            memory ^= flip.astype(memory.dtype) << qubit
+        return memory
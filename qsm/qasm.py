@@ -0,0 +1,319 @@
+import math
+import re
+
+import numpy as np
+
+from qsm.gate_library.gate_matrix import hadamard, rx, rxx, ry, rz, rzz, sx, sxdg, u
+from qsm.instruction import Instruction
+
+# QASM gate name -> (QuantumCircuit method, number of parameters, number of qubits).
+# Parameters come before the qubits in the method call, except for rx/ry/rz which
+# take the qubit first.
+_READ_GATES = {
+    "h": ("h", 0, 1), "x": ("x", 0, 1), "y": ("y", 0, 1), "z": ("z", 0, 1),
+    "s": ("s", 0, 1), "sdg": ("sdg", 0, 1), "t": ("t", 0, 1), "tdg": ("tdg", 0, 1),
+    "rx": ("rx", 1, 1), "ry": ("ry", 1, 1), "rz": ("rz", 1, 1),
+    "u3": ("u3", 3, 1), "u": ("u3", 3, 1), "U": ("u3", 3, 1), "u2": ("u2", 2, 1),
+    "u1": ("u1", 1, 1), "p": ("p", 1, 1),
+    "cx": ("cx", 0, 2), "CX": ("cx", 0, 2), "cy": ("cy", 0, 2), "cz": ("cz", 0, 2),
+    "cu1": ("cp", 1, 2), "cp": ("cp", 1, 2), "swap": ("swap", 0, 2), "ccx": ("ccx", 0, 3),
+}
+_QUBIT_FIRST = {"rx", "ry", "rz"}
+# Gates without a QuantumCircuit method: name -> (matrix function, number of
+# parameters, number of qubits), recorded as a custom gate of that name
+_MATRIX_GATES = {"sx": (sx, 0, 1), "sxdg": (sxdg, 0, 1), "rxx": (rxx, 1, 2), "rzz": (rzz, 1, 2)}
+# Controlled gates without a QuantumCircuit method go through custom_control:
+# name -> (target matrix function, number of parameters)
+_CONTROLLED = {"ch": (hadamard, 0), "crx": (rx, 1), "cry": (ry, 1), "crz": (rz, 1), "cu3": (u, 3)}
+_SKIPPED = {"barrier", "id", "creg"}
+
+# Recorded instruction name -> (QASM name, number of qubits), for the writer
+_WRITE_NAMES = {
+    "h": ("h", 1), "x": ("x", 1), "y": ("y", 1), "z": ("z", 1), "s": ("s", 1), "sdg": ("sdg", 1),
+    "t": ("t", 1), "tdg": ("tdg", 1), "rx": ("rx", 1), "ry": ("ry", 1), "rz": ("rz", 1),
+    "u3": ("u3", 1), "u2": ("u2", 1), "u1": ("u1", 1), "p": ("u1", 1), "sx": ("sx", 1), "sxdg": ("sxdg", 1),
+    "cx": ("cx", 2), "cy": ("cy", 2), "cz": ("cz", 2), "cp": ("cu1", 2), "ch": ("ch", 2),
+    "crx": ("crx", 2), "cry": ("cry", 2), "crz": ("crz", 2), "cu3": ("cu3", 2), "swap": ("swap", 2),
+    "rxx": ("rxx", 2), "rzz": ("rzz", 2),
+    "ccx": ("ccx", 3), "measure": ("measure", 1),
+}
+
+_STATEMENT = re.compile(r"\s*([A-Za-z_]\w*)\s*(?:\(((?:[^()]|\((?:[^()]|\([^()]*\))*\))*)\))?\s*(.*)", re.S)
+_ARGUMENT = re.compile(r"([A-Za-z_]\w*)\s*(?:\[\s*(\d+)\s*\])?")
+_DEFINITION = re.compile(r"([A-Za-z_]\w*)\s*(?:\(([^)]*)\))?\s*([^{]*)\{(.*)\}\s*$", re.S)
+# Numbers are matched whole so that the exponent of 1e-3 is not taken for a name
+_EXPRESSION_TOKEN = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|([A-Za-z_]\w*)")
+_EXPRESSION_NAMES = {"pi": math.pi, "sin": math.sin, "cos": math.cos, "tan": math.tan,
+                     "exp": math.exp, "ln": math.log, "sqrt": math.sqrt}
+
+
+def _statements(lines):
+    # Yields the ';'-terminated statements of a stream of lines, comments removed. A
+    # gate definition is one statement, from `gate` to its closing brace.
+    pending, depth = "", 0
+    for line in lines:
+        line = line.split("//", 1)[0]
+        if depth or "{" in line or "}" in line:
+            for token in re.split(r"([;{}])", line):
+                if token == ";" and not depth:
+                    if pending.strip():
+                        yield pending
+                    pending = ""
+                    continue
+                pending += token
+                depth += (token == "{") - (token == "}")
+                if depth < 0:
+                    raise ValueError("Unmatched '}}' in QASM statement: {!r}".format(pending.strip()))
+                if token == "}" and not depth:
+                    yield pending
+                    pending = ""
+            continue
+        if ";" not in line:
+            pending += line
+            continue
+        *complete, pending_tail = line.split(";")
+        complete[0] = pending + complete[0]
+        pending = pending_tail
+        for statement in complete:
+            if statement.strip():
+                yield statement
+    if pending.strip():
+        raise ValueError("Unterminated QASM statement: {!r}".format(pending.strip()))
+
+
+class QasmReader:
+    """
+    Streams an OpenQASM 2 program into a QuantumCircuit one statement at a time;
+    the text is never held in memory and no syntax tree is built. Gates are
+    dispatched to the circuit's own methods, so they are recorded exactly as if
+    called by hand. Parameter expressions are evaluated once per distinct string.
+
+    Gate definitions (gate name(params) qubits { ... }) are expanded where they
+    are called, into the gates of their body; opaque gates are rejected. Qubit
+    indices are checked against the size of their register.
+    ...
+    Args:
+        circuit_factory: Called with the total number of qubits once the qreg
+        declarations are over, returns the QuantumCircuit to fill.
+    """
+
+    def __init__(self, circuit_factory):
+        self.circuit_factory = circuit_factory
+        self.registers = {}
+        self.num_qubits = 0
+        self.circuit = None
+        self._expressions = {}
+        # (name, parameter text) -> (bound call, qubit count)
+        self._gates = {}
+        # Gate name -> (parameter names, qubit names, body as (name, parameter text, qubit names))
+        self._definitions = {}
+
+    def _value(self, expression, scope=None):
+        # scope holds the parameters of the gate definition the expression belongs to
+        value = None if scope else self._expressions.get(expression)
+        if value is None:
+            names = dict(_EXPRESSION_NAMES, **scope) if scope else _EXPRESSION_NAMES
+            try:
+                value = float(expression)
+            except ValueError:
+                found = set(_EXPRESSION_TOKEN.findall(expression)) - {""}
+                if found - names.keys() or not re.fullmatch(r"[\w\s.+\-*/^()]*", expression):
+                    raise ValueError("Unsupported QASM expression: {!r}".format(expression))
+                # Names get a prefix, so parameters such as lambda are not read as Python keywords
+                renamed = _EXPRESSION_TOKEN.sub(lambda match: "_" + match.group(1) if match.group(1) else match.group(), expression)
+                local = {"_" + name: names[name] for name in found}
+                value = float(eval(renamed.replace("^", "**"), {"__builtins__": {}}, local))
+            if not scope:
+                self._expressions[expression] = value
+        return value
+
+    def _register(self, name):
+        if name not in self.registers:
+            raise ValueError("Undeclared QASM register {!r}".format(name))
+        return self.registers[name]
+
+    def _qubit(self, name, index):
+        offset, size = self._register(name)
+        if int(index) >= size:
+            raise ValueError("{}[{}] is out of range for qreg {}[{}]".format(name, index, name, size))
+        return offset + int(index)
+
+    def _qubits(self, arguments):
+        # One qubit list per argument; a bare register stands for all of its qubits
+        qubits = []
+        for name, index in _ARGUMENT.findall(arguments):
+            if index:
+                qubits.append([self._qubit(name, index)])
+            else:
+                offset, size = self._register(name)
+                qubits.append(list(range(offset, offset + size)))
+        return qubits
+
+    def _gate_calls(self, arguments):
+        # Register arguments are broadcast: gate q, r[0]; runs once per qubit of q
+        found = _ARGUMENT.findall(arguments)
+        if all(index for _, index in found):
+            return [[self._qubit(name, index) for name, index in found]]
+        qubits = self._qubits(arguments)
+        if all(len(argument) == 1 for argument in qubits):
+            return [[argument[0] for argument in qubits]]
+        width = max(len(argument) for argument in qubits)
+        return [[argument[i] if len(argument) > 1 else argument[0] for argument in qubits] for i in range(width)]
+
+    def statement(self, text):
+        name, params, arguments = _STATEMENT.match(text).groups()
+        if name == "qreg":
+            register, size = _ARGUMENT.match(arguments).groups()
+            if self.circuit is not None:
+                raise ValueError("qreg {} is declared after the first gate".format(register))
+            self.registers[register] = (self.num_qubits, int(size))
+            self.num_qubits += int(size)
+            return
+        if name in ("OPENQASM", "include") or name in _SKIPPED:
+            return
+        if name == "gate":
+            self._define(arguments, text)
+            return
+        if name == "opaque":
+            raise ValueError("Opaque gates have no definition to simulate: {!r}".format(text.strip()))
+        gate = self._gates.get((name, params))
+        if gate is None:
+            gate = self._gates[(name, params)] = self._gate(name, params, text)
+        call, num_qubits = gate
+        if name == "measure":
+            arguments = arguments.split("->")[0]
+        for qubits in self._gate_calls(arguments):
+            if len(qubits) != num_qubits:
+                raise ValueError("{} acts on {} qubits: {!r}".format(name, num_qubits, text.strip()))
+            call(*qubits)
+
+    def _define(self, arguments, text):
+        match = _DEFINITION.match(arguments)
+        if match is None:
+            raise ValueError("Malformed QASM gate definition: {!r}".format(text.strip()))
+        name, params, qubits, body = match.groups()
+        params = [param.strip() for param in params.split(",")] if params and params.strip() else []
+        qubits = [qubit.strip() for qubit in qubits.split(",")]
+        statements = []
+        for statement in body.split(";"):
+            if statement.strip():
+                inner, inner_params, inner_arguments = _STATEMENT.match(statement).groups()
+                if inner not in _SKIPPED:
+                    statements.append((inner, inner_params, [argument.strip() for argument in inner_arguments.split(",")]))
+        self._definitions[name] = (params, qubits, statements)
+
+    def _gate(self, name, params, text):
+        # The call that records one gate of this name and parameter text, bound once
+        if self.circuit is None:
+            self.circuit = self.circuit_factory(self.num_qubits)
+        values = [self._value(param.strip()) for param in params.split(",")] if params else []
+        return self._bind(name, values, text)
+
+    def _bind(self, name, values, text):
+        circuit = self.circuit
+        if name == "measure":
+            return circuit.measure, 1
+        if name in _READ_GATES:
+            method, num_params, num_qubits = _READ_GATES[name]
+            _check_params(name, values, num_params, text)
+            method = getattr(circuit, method)
+            if name in _QUBIT_FIRST:
+                return (lambda *qubits: method(*qubits, *values)), num_qubits
+            return (lambda *qubits: method(*values, *qubits)), num_qubits
+        if name in _MATRIX_GATES:
+            function, num_params, num_qubits = _MATRIX_GATES[name]
+            _check_params(name, values, num_params, text)
+            matrix = function(*values)
+            return (lambda *qubits: circuit.append(Instruction(matrix, name, qubits, tuple(values)))), num_qubits
+        if name in _CONTROLLED:
+            function, num_params = _CONTROLLED[name]
+            _check_params(name, values, num_params, text)
+            matrix = function(*values)
+            return (lambda control, target: circuit.custom_control(control, target, matrix, name, tuple(values))), 2
+        if name == "cswap":
+            return self._cswap, 3
+        if name in self._definitions:
+            return self._expansion(name, values, text)
+        raise ValueError("Unsupported QASM statement: {!r}".format(text.strip()))
+
+    def _cswap(self, control, qubit1, qubit2):
+        self.circuit.cx(qubit2, qubit1)
+        self.circuit.ccx(control, qubit1, qubit2)
+        self.circuit.cx(qubit2, qubit1)
+
+    def _expansion(self, name, values, text):
+        # The gates of a definition's body, bound once for these parameter values
+        params, qubits, body = self._definitions[name]
+        _check_params(name, values, len(params), text)
+        scope = dict(zip(params, values))
+        steps = []
+        for inner, inner_params, arguments in body:
+            inner_values = [self._value(param.strip(), scope) for param in inner_params.split(",")] if inner_params else []
+            call, num_qubits = self._bind(inner, inner_values, text)
+            if len(arguments) != num_qubits or set(arguments) - set(qubits):
+                raise ValueError("{} in the definition of {} does not act on its qubits {}".format(inner, name, qubits))
+            steps.append((call, [qubits.index(argument) for argument in arguments]))
+
+        def call(*targets):
+            for step, positions in steps:
+                step(*[targets[position] for position in positions])
+
+        return call, len(qubits)
+
+    def read(self, lines):
+        for text in _statements(lines):
+            self.statement(text)
+        if self.circuit is None:
+            self.circuit = self.circuit_factory(self.num_qubits)
+        return self.circuit
+
+
+def _check_params(name, values, num_params, text):
+    if len(values) != num_params:
+        raise ValueError("{} takes {} parameters: {!r}".format(name, num_params, text.strip()))
+
+
+def read_qasm(source, circuit_factory):
+    """
+    Reads OpenQASM 2 from a path or an iterable of lines (e.g. an open file).
+    """
+    if isinstance(source, str):
+        with open(source) as lines:
+            return QasmReader(circuit_factory).read(lines)
+    return QasmReader(circuit_factory).read(source)
+
+
+def _format(value):
+    return repr(float(value))
+
+
+def qasm_lines(circuit):
+    """
+    Yields the OpenQASM 2 program of a circuit line by line.
+    """
+    yield "OPENQASM 2.0;\n"
+    yield 'include "qelib1.inc";\n'
+    yield "qreg q[{}];\n".format(circuit.num_qubits)
+    if any(instruction.name == "measure" for instruction in circuit.instructions):
+        yield "creg c[{}];\n".format(circuit.num_qubits)
+    for instruction in circuit.instructions:
+        name, num_qubits = _WRITE_NAMES.get(instruction.name, (None, 0))
+        if num_qubits != len(instruction.qubits) or any(np.ndim(param) for param in instruction.params):
+            raise ValueError("{!r} has no OpenQASM 2 form".format(instruction))
+        if name == "measure":
+            qubit = instruction.qubits[0]
+            yield "measure q[{0}] -> c[{0}];\n".format(qubit)
+            continue
+        params = "({})".format(",".join(_format(param) for param in instruction.params)) if instruction.params else ""
+        yield "{}{} {};\n".format(name, params, ",".join("q[{}]".format(qubit) for qubit in instruction.qubits))
+
+
+def write_qasm(circuit, target):
+    """
+    Writes a circuit as OpenQASM 2 to a path or a writable text file.
+    """
+    if isinstance(target, str):
+        with open(target, "w") as handle:
+            handle.writelines(qasm_lines(circuit))
+    else:
+        target.writelines(qasm_lines(circuit))
@@ -1,11 +1,121 @@
 import numpy as np
 
+from qsm.compiler import instruction_gate, measured_outcome
+from qsm.kernels import measure_qubit
+from qsm.results import Counts
+
+
+def _check_dtype(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in (np.complex64, np.complex128):
+        raise ValueError("The state dtype must be complex64 or complex128, not {}".format(dtype))
+    return dtype
+
 
 class Qubit:
-    def __init__(self, size):
-        self.state = np.array([1, 0])
-        for i in range(size-1):
-            self.state = np.kron(self.state, np.array([1, 0]))
+    def __init__(self, size, batch_size=None, dtype=np.complex128):
+        self.dtype = _check_dtype(dtype)
+        self.num_qubits = size
+        self.batch_size = batch_size
+        shape = (2 ** size,) if batch_size is None else (batch_size, 2 ** size)
+        self.state = np.zeros(shape, dtype=self.dtype)
+        self.state[..., 0] = 1
+
+    @classmethod
+    def _adopt(cls, state):
+        qubit = cls.__new__(cls)
+        qubit.dtype = state.dtype
+        qubit.num_qubits = int(np.log2(state.shape[-1]))
+        qubit.batch_size = state.shape[0] if state.ndim == 2 else None
+        qubit.state = state
+        return qubit
+
+    @classmethod
+    def from_basis_state(cls, size, basis_state, batch_size=None, dtype=np.complex128):
+        """
+        Register prepared in a computational basis state.
+        ...
+        Args:
+            size: Number of qubits.
+            basis_state: Index of the basis state (qubit k is bit k), or its
+            bitstring with the highest qubit first.
+        """
+        if isinstance(basis_state, str):
+            basis_state = int(basis_state, 2)
+        qubit = cls(size, batch_size, dtype)
+        qubit.state[..., 0] = 0
+        qubit.state[..., basis_state] = 1
+        return qubit
+
+    @classmethod
+    def from_amplitudes(cls, amplitudes):
+        """
+        Register that adopts a caller-owned amplitude buffer without copying it;
+        gates then update that buffer in place.
+        ...
+        Args:
+            amplitudes: C-contiguous, writable complex64 or complex128 array of
+            shape (2^n,) or (batch, 2^n).
+        """
+        if not isinstance(amplitudes, np.ndarray):
+            raise ValueError("The amplitudes must be a NumPy array to be adopted without a copy")
+        _check_dtype(amplitudes.dtype)
+        if amplitudes.ndim not in (1, 2) or amplitudes.shape[-1] & (amplitudes.shape[-1] - 1):
+            raise ValueError("The amplitudes must have shape (2^n,) or (batch, 2^n)")
+        if not amplitudes.flags.c_contiguous or not amplitudes.flags.writeable:
+            raise ValueError("The amplitudes must be C-contiguous and writable")
+        return cls._adopt(amplitudes)
+
+    @classmethod
+    def from_product_state(cls, vectors, dtype=np.complex128):
+        """
+        Register prepared in the product state of one 2-vector per qubit.
+        ...
+        Args:
+            vectors: Sequence of single-qubit states, vectors[k] is qubit k.
+        """
+        state = np.asarray(vectors[0], dtype=_check_dtype(dtype))
+        for vector in vectors[1:]:
+            state = np.multiply.outer(np.asarray(vector, dtype=state.dtype), state).ravel()
+        return cls._adopt(np.ascontiguousarray(state))
+
+    def reset(self):
+        # Back to |0...0> in place, without reallocating the register
+        self.state.fill(0)
+        self.state[..., 0] = 1
+
+    def run(self, plan, rng=None):
+        self.state = plan.run(self.state, rng)
+        return plan.outcomes
+
+    def probabilities(self):
+        self.state /= np.linalg.norm(self.state, axis=-1, keepdims=True)
+        return np.abs(self.state) ** 2
+
+    def sample_counts(self, shots, rng):
+        prob = self.probabilities().astype(np.float64)
+        counts = rng.multinomial(shots, prob / prob.sum(axis=-1, keepdims=True))
+        if counts.ndim == 1:
+            return Counts.from_dense(counts, self.num_qubits)
+        return [Counts.from_dense(row, self.num_qubits) for row in counts]
+
+    def sample_memory(self, shots, rng):
+        prob = self.probabilities().astype(np.float64)
+        # One basis-state index per shot, drawn by inverting the cumulative distribution
+        cumulative = np.cumsum(prob, axis=-1)
+        draws = rng.random(prob.shape[:-1] + (shots,)) * cumulative[..., -1:]
+        if prob.ndim == 1:
+            return np.searchsorted(cumulative, draws, side="right")
+        return np.array([np.searchsorted(row, draw, side="right") for row, draw in zip(cumulative, draws)])
+
+    def measure(self, qubit, rng=None, outcome=None):
+        return measure_qubit(self.state, qubit, rng, outcome)
+
+    def apply_instruction(self, instruction, rng=None):
+        if instruction.name == "measure":
+            return self.measure(instruction.qubits[0], rng, measured_outcome(instruction))
+        gate, args = instruction_gate(instruction)
+        self.state = gate.apply(self.state, *args)
 
     def apply_gate(self, gate, target_qubit):
         self.state = gate.apply(self.state, target_qubit)
@@ -14,4 +124,4 @@ class Qubit:
         self.state = gate.apply(self.state, target_qubit, other_qubit)
 
     def apply_controlled_controlled_gate(self, gate, target_qubit, control_qubit1, control_qubit2):
-        self.state = gate.apply(self.state, control_qubit1, control_qubit2, target_qubit)
\ No newline at end of file
+        self.state = gate.apply(self.state, control_qubit1, control_qubit2, target_qubit)
@@ -0,0 +1,108 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def outcomes_from_bits(bits):
+    """
+    Basis-state indices of sampled bit rows, bits[:, k] being qubit k. Registers
+    wider than 62 qubits get Python int outcomes so nothing overflows.
+    """
+    num_qubits = bits.shape[1]
+    if num_qubits <= 62:
+        return (bits.astype(np.int64) << np.arange(num_qubits, dtype=np.int64)).sum(axis=1)
+    rows, inverse = np.unique(bits, axis=0, return_inverse=True)
+    values = np.array([int("".join(map(str, row[::-1])), 2) for row in rows], dtype=object)
+    return values[inverse.reshape(-1)]
+
+
+class Counts(Mapping):
+    """
+    Measurement counts stored as two NumPy arrays: the sorted basis-state indices
+    that were observed and how often each one occurred. Bitstrings are only
+    rendered when the counts are iterated or printed, and only for outcomes that
+    actually occurred, so the memory stays O(shots) instead of O(2^n).
+
+    Keys follow the bitstring convention of the circuit: the leftmost character is
+    the highest qubit. Looking up a valid bitstring that never occurred returns 0,
+    but only outcomes that occurred are `in` the counts, as in keys() and len().
+    Registers wider than 62 qubits keep their outcomes as Python ints (object
+    arrays) so they do not overflow.
+    """
+
+    def __init__(self, outcomes, counts, num_qubits):
+        outcomes = np.asarray(outcomes)
+        self.outcomes = outcomes if outcomes.dtype == object else outcomes.astype(np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.num_qubits = num_qubits
+
+    @classmethod
+    def from_memory(cls, memory, num_qubits):
+        outcomes, counts = np.unique(np.asarray(memory), return_counts=True)
+        return cls(outcomes, counts, num_qubits)
+
+    @classmethod
+    def from_dense(cls, dense_counts, num_qubits):
+        outcomes = np.flatnonzero(dense_counts)
+        return cls(outcomes, np.asarray(dense_counts)[outcomes], num_qubits)
+
+    @property
+    def shots(self):
+        return int(self.counts.sum())
+
+    def bitstring(self, outcome):
+        return format(int(outcome), "0{}b".format(self.num_qubits))
+
+    def _index(self, key):
+        if isinstance(key, str):
+            if len(key) != self.num_qubits or set(key) - {"0", "1"}:
+                raise KeyError(key)
+            return int(key, 2)
+        if isinstance(key, (int, np.integer)) and 0 <= int(key) < 2 ** self.num_qubits:
+            return int(key)
+        raise KeyError(key)
+
+    def _position(self, key):
+        # Position of the key among the observed outcomes, None if it never occurred
+        index = self._index(key)
+        pos = np.searchsorted(self.outcomes, index)
+        if pos < len(self.outcomes) and self.outcomes[pos] == index:
+            return pos
+        return None
+
+    def __getitem__(self, key):
+        pos = self._position(key)
+        return 0 if pos is None else int(self.counts[pos])
+
+    def __contains__(self, key):
+        try:
+            return self._position(key) is not None
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return (self.bitstring(outcome) for outcome in self.outcomes)
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def int_counts(self):
+        return {int(outcome): int(count) for outcome, count in zip(self.outcomes, self.counts)}
+
+    def marginal_counts(self, qubits):
+        """
+        Counts restricted to a subset of qubits. qubits[j] becomes bit j of the
+        marginal outcome, so the returned keys read qubits[-1] ... qubits[0].
+        ...
+        Args:
+            qubits: Sequence of qubit indices to keep.
+        """
+        reduced = np.zeros_like(self.outcomes)
+        for position, qubit in enumerate(qubits):
+            reduced |= ((self.outcomes >> qubit) & 1) << position
+        outcomes, inverse = np.unique(reduced, return_inverse=True)
+        counts = np.bincount(inverse, weights=self.counts, minlength=len(outcomes))
+        return Counts(outcomes, counts.astype(np.int64), len(qubits))
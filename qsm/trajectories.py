@@ -0,0 +1,112 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from qsm.compiler import compile_circuit
+
+# Set in every worker process by _init_worker, so the circuit is pickled once per worker
+_worker_segments = None
+
+
+def compile_segments(instructions, num_qubits, fusion_width=2, dtype=np.complex128):
+    """
+    Splits a noisy circuit at its Kraus channels: a list of (channel, plan) pairs,
+    where each plan holds the compiled gates up to the next channel. The first
+    channel is None.
+    """
+    segments, channel, gates = [], None, []
+    for instruction in instructions:
+        if instruction.name == "kraus":
+            segments.append((channel, compile_circuit(gates, num_qubits, fusion_width, dtype)))
+            channel, gates = instruction, []
+        else:
+            gates.append(instruction)
+    segments.append((channel, compile_circuit(gates, num_qubits, fusion_width, dtype)))
+    return segments
+
+
+def apply_kraus_branches(states, kraus, qubits, rng):
+    """
+    Picks one Kraus branch per row of a batch of pure states, with probability
+    ||K psi||^2, and renormalizes. The branch probabilities come from the reduced
+    density matrix of the channel's qubits, and every row is then multiplied by its
+    chosen operator in one batched matmul, written back through a view.
+    ...
+    Args:
+        states: (batch, 2^n) states, one trajectory per row.
+        kraus: Stack of Kraus operators, shape (k, 2^m, 2^m).
+        qubits: The m qubits the channel acts on.
+        rng: np.random.Generator.
+    """
+    batch, num_qubits = len(states), int(np.log2(states.shape[1]))
+    dim = 2 ** len(qubits)
+    # Qubit q is axis num_qubits - q of the (batch, 2, ..., 2) view
+    view = np.moveaxis(states.reshape((batch,) + (2,) * num_qubits), [num_qubits - qubit for qubit in qubits], range(1, len(qubits) + 1))
+    tensor = view.reshape(batch, dim, -1)
+    reduced = tensor @ tensor.conj().transpose(0, 2, 1)
+    prob = np.einsum("kij,bjl,kil->bk", kraus, reduced, kraus.conj()).real
+    cumulative = np.cumsum(prob, axis=1)
+    # Rows the rounding leaves past the last boundary fall into the last branch
+    chosen = np.minimum((rng.random(batch)[:, np.newaxis] * cumulative[:, -1:] >= cumulative).sum(axis=1), len(kraus) - 1)
+    operators = kraus[chosen] / np.sqrt(prob[np.arange(batch), chosen])[:, np.newaxis, np.newaxis]
+    view[...] = (operators.astype(states.dtype) @ tensor).reshape(view.shape)
+    return states
+
+
+def sample_trajectories(segments, num_qubits, shots, rng, dtype=np.complex128, block_amplitudes=2 ** 20):
+    """
+    Runs `shots` trajectories in batches of at most block_amplitudes amplitudes
+    and draws one outcome from each final state.
+    """
+    block = max(1, block_amplitudes >> num_qubits)
+    memory = []
+    for start in range(0, shots, block):
+        count = min(block, shots - start)
+        states = np.zeros((count, 2 ** num_qubits), dtype=dtype)
+        states[:, 0] = 1
+        for channel, plan in segments:
+            if channel is not None:
+                states = apply_kraus_branches(states, channel.matrix, channel.qubits, rng)
+            states = plan.run(states, rng)
+        cumulative = np.cumsum(np.abs(states) ** 2, axis=1)
+        draws = rng.random(count) * cumulative[:, -1]
+        memory.append(np.array([np.searchsorted(row, draw, side="right") for row, draw in zip(cumulative, draws)]))
+    return np.concatenate(memory) if memory else np.zeros(0, dtype=np.int64)
+
+
+def _init_worker(instructions, num_qubits, fusion_width, dtype):
+    global _worker_segments
+    _worker_segments = (compile_segments(instructions, num_qubits, fusion_width, dtype), num_qubits, dtype)
+
+
+def _worker_memory(shots, seed):
+    segments, num_qubits, dtype = _worker_segments
+    return sample_trajectories(segments, num_qubits, shots, np.random.default_rng(seed), dtype)
+
+
+def run_trajectories(instructions, num_qubits, shots, workers=None, seed=None, fusion_width=2, dtype=np.complex128):
+    """
+    Monte-Carlo trajectory simulation of a circuit with "kraus" instructions on
+    pure states, one trajectory per shot. The shots are split evenly over a
+    ProcessPoolExecutor; the instructions reach each worker once through its
+    initializer and every task gets its own seed spawned from `seed`, so a seed
+    gives the same memory for a given number of workers.
+    ...
+    Args:
+        instructions: The circuit's instructions, channels included.
+        num_qubits: Width of the register.
+        shots: Number of trajectories.
+        workers: Worker processes, os.cpu_count() when None, and never more than
+        the shots. With 1 the trajectories run in this process.
+        seed: Seed for np.random.SeedSequence.
+    """
+    # Every task gets at least one shot
+    workers = max(min(workers or os.cpu_count() or 1, shots), 1)
+    tasks = [shots // workers + (index < shots % workers) for index in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    if workers == 1:
+        _init_worker(instructions, num_qubits, fusion_width, dtype)
+        return _worker_memory(shots, seeds[0])
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(instructions, num_qubits, fusion_width, dtype)) as pool:
+        return np.concatenate(list(pool.map(_worker_memory, tasks, seeds)))
@@ -1,5 +1,6 @@
 import numpy as np
 from qsm.gate_library.gate_matrix import *
+from qsm.instruction import Instruction
 
 
 def possible_bits(state):
@@ -52,6 +53,19 @@ projectors = [np.array([[1, 0], [0, 0]]), np.array([[0, 0], [0, 1]])]
 
 
 def project(i, j, reg):
-    reg.customgate(i, projectors[j])
-    reg.qubits.state /= np.linalg.norm(reg.qubits.state)
+    # Recorded as a measurement of qubit i with outcome j, so every backend collapses it through its own
+    # measure() and a replay (e.g. leaving the stabilizer tableau) projects again
+    reg.append(Instruction(None, "measure", (i,), (j,)))
+    reg._flush()
     return reg.qubits.state
+
+
+def equal_up_to_global_phase(a, b, atol=1e-8):
+    a, b = np.asarray(a), np.asarray(b)
+    if a.shape != b.shape:
+        return False
+    # The phase is read off the overlap, then the arrays must agree elementwise
+    overlap = np.vdot(a, b)
+    if abs(overlap) <= atol:
+        return np.allclose(a, b, atol=atol)
+    return np.allclose(b, a * overlap / abs(overlap), atol=atol)
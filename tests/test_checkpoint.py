@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+from qsm import PrefixCache, QuantumCircuit, load_checkpoint
+
+
+def layers(circuit, depth, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(depth):
+        for qubit in range(circuit.num_qubits):
+            circuit.rx(qubit, rng.random())
+            circuit.rz(qubit, rng.random())
+        for qubit in range(circuit.num_qubits - 1):
+            circuit.cx(qubit, qubit + 1)
+    return circuit
+
+
+def sibling(seed):
+    # A shared prefix of 170 instructions followed by 34 of its own
+    return layers(layers(QuantumCircuit(6, lazy=True, backend="statevector"), 10, 0), 2, seed)
+
+
+def test_sibling_circuits_share_the_cached_prefix():
+    cache = PrefixCache(interval=50)
+    sibling(1).run(prefix_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    # States after instructions 50, 100, 150, 200 and at the end, 204
+    assert len(cache) == 5
+
+    # The circuits part at instruction 170, so the hit is one of the intermediate states
+    second = sibling(2).run(prefix_cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    np.testing.assert_allclose(second.qubits.state, sibling(2).run().qubits.state)
+
+
+def test_checkpoint_restore_and_resume(tmp_path):
+    path = os.path.join(tmp_path, "state.npz")
+    reference = layers(QuantumCircuit(5, lazy=True), 8, 3).run().qubits.state
+
+    partial = layers(QuantumCircuit(5, lazy=True), 8, 3)
+    partial.instructions = partial.instructions[:60]
+    partial.run()
+    partial.checkpoint(path, compressed=True)
+    assert load_checkpoint(path)["position"] == 60
+
+    restored = layers(QuantumCircuit(5, lazy=True), 8, 3).restore(path)
+    np.testing.assert_allclose(restored.qubits.state, partial.qubits.state)
+    np.testing.assert_allclose(restored.resume().qubits.state, reference)
+
+    with pytest.raises(ValueError):
+        layers(QuantumCircuit(5, lazy=True), 8, 4).restore(path)
+
+
+def test_periodic_checkpoints(tmp_path):
+    path = os.path.join(tmp_path, "state.npz")
+    circuit = layers(QuantumCircuit(4, lazy=True), 5, 5)
+    circuit.run(checkpoint=path, checkpoint_every=16)
+    assert load_checkpoint(path)["position"] == len(circuit.instructions)
+
+
+def test_resume_leaves_the_tableau_for_non_clifford_gates():
+    circuit = QuantumCircuit(2, lazy=True)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.run()
+    circuit.t(1)
+    circuit.resume()
+    reference = QuantumCircuit(2, backend="statevector")
+    reference.h(0)
+    reference.cx(0, 1)
+    reference.t(1)
+    np.testing.assert_allclose(circuit.qubits.state, reference.qubits.state)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from qsm import ChunkedQubit, QuantumCircuit
+
+
+def qft(circuit):
+    for target in reversed(range(circuit.num_qubits)):
+        circuit.rx(target, 0.1 * target + 0.2)
+        circuit.h(target)
+        for control in reversed(range(target)):
+            circuit.cp(np.pi / 2 ** (target - control), control, target)
+
+
+@pytest.mark.parametrize("fusion_width", [0, 2, 4])
+def test_phase_heavy_circuit_matches_the_state_vector(fusion_width):
+    reference = QuantumCircuit(10, lazy=True, backend="statevector")
+    register = ChunkedQubit(10, chunk_qubits=4, group_qubits=2)
+    chunked = QuantumCircuit(10, lazy=True, backend=register)
+    for circuit in (reference, chunked):
+        qft(circuit)
+        circuit.run(fusion_width)
+    assert np.allclose(np.asarray(register.state), reference.qubits.state)
+    register.close()
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from qsm import QuantumCircuit, read_circuit
+
+
+def build(dtype):
+    circuit = QuantumCircuit(5, lazy=True, dtype=dtype)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.rx(2, 0.3)
+    circuit.u3(0.1, 0.2, 0.3, 3)
+    circuit.ccx(0, 1, 4)
+    circuit.swap(2, 3)
+    circuit.cp(0.7, 1, 2)
+    circuit.custom_control([0, 2], 4, np.array([[0, -1j], [1j, 0]]), "ccy")
+    circuit.t(4)
+    circuit.rz(0, 1.1)
+    return circuit
+
+
+@pytest.mark.parametrize("dtype", [np.complex64, np.complex128])
+def test_round_trip(tmp_path, dtype):
+    circuit = build(dtype)
+    path = os.path.join(tmp_path, "circuit.qsmc")
+    circuit.save(path)
+    loaded = QuantumCircuit.load(path)
+
+    assert loaded.dtype == np.dtype(dtype)
+    assert isinstance(loaded.instructions.records, np.memmap)
+    assert len(loaded.instructions) == len(circuit.instructions)
+    for original, read in zip(circuit.instructions, loaded.instructions):
+        assert read.name == original.name
+        assert read.qubits == original.qubits
+        assert read.params == pytest.approx(original.params)
+        assert read.num_controls == original.num_controls
+        assert read.matrix.dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(read.matrix, original.matrix)
+
+    np.testing.assert_array_equal(loaded.run().qubits.state, circuit.run().qubits.state)
+
+
+def test_matrices_are_stored_once(tmp_path):
+    circuit = QuantumCircuit(4, lazy=True, dtype=np.complex64)
+    for _ in range(1000):
+        circuit.h(0)
+        circuit.cx(1, 2)
+    path = os.path.join(tmp_path, "circuit.qsmc")
+    circuit.save(path)
+    _, instructions = read_circuit(path)
+    assert len(instructions.table) == 2
+
+
+def test_appended_instructions_follow_the_mapped_ones(tmp_path):
+    circuit = build(np.complex128)
+    path = os.path.join(tmp_path, "circuit.qsmc")
+    circuit.save(path)
+    loaded = QuantumCircuit.load(path)
+    circuit.h(3)
+    loaded.h(3)
+    assert loaded.instructions[-1].name == "h"
+    np.testing.assert_array_equal(loaded.state_vector(), circuit.state_vector())
+
+
+def test_rejects_other_files(tmp_path):
+    path = os.path.join(tmp_path, "circuit.qsmc")
+    with open(path, "wb") as handle:
+        handle.write(b"\0" * 256)
+    with pytest.raises(ValueError):
+        QuantumCircuit.load(path)
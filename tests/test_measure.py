@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from qsm import QuantumCircuit, load_checkpoint
+
+
+def bell_measured(seed):
+    circuit = QuantumCircuit(2, lazy=True)
+    circuit.h(0)
+    circuit.measure(0)
+    circuit.cx(0, 1)
+    return circuit.run(rng=seed)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_leaving_the_tableau_keeps_the_drawn_outcomes(seed, tmp_path):
+    circuit = bell_measured(seed)
+    outcome = circuit.outcomes[0]
+    assert abs(circuit.state_vector()[3 * outcome]) == pytest.approx(1)
+    assert circuit.outcomes == [outcome]
+
+    circuit = bell_measured(seed)
+    circuit.t(1)
+    assert circuit.probabilities()[3 * outcome] == pytest.approx(1)
+
+    circuit = bell_measured(seed)
+    path = str(tmp_path / "state.npz")
+    circuit.checkpoint(path)
+    snapshot = load_checkpoint(path)
+    assert list(snapshot["outcomes"]) == [outcome]
+    assert abs(snapshot["state"][3 * outcome]) == pytest.approx(1)
@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+import pytest
+
+from qsm import QuantumCircuit
+
+HEADER = 'OPENQASM 2.0;\ninclude "qelib1.inc";\nqreg q[3];\n'
+# The qelib1.inc definitions, which the reader expands like any other gate definition
+DEFINITIONS = """
+gate mycu3(theta,phi,lambda) c, t
+{
+  u1((lambda+phi)/2) c;
+  u1((lambda-phi)/2) t;
+  cx c,t;
+  u3(-theta/2,0,-(phi+lambda)/2) t;
+  cx c,t;
+  u3(theta/2,phi,0) t;
+}
+gate mycswap a,b,c { cx c,b; ccx a,b,c; cx c,b; }
+gate myrxx(theta) a,b { u3(pi/2, theta, 0) a; h b; cx a,b; u1(-theta) b; cx a,b; h b; u2(-pi, pi - theta) a; }
+gate myrzz(theta) a,b { cx a,b; u1(theta) b; cx a,b; }
+gate mysx a { sdg a; h a; sdg a; }
+"""
+
+
+def read(program):
+    return QuantumCircuit.from_qasm(io.StringIO(HEADER + DEFINITIONS + "h q;\n" + program))
+
+
+@pytest.mark.parametrize(
+    "gate, definition",
+    [
+        ("cu3(0.3,0.5,0.7) q[2],q[0];", "mycu3(0.3,0.5,0.7) q[2],q[0];"),
+        ("cswap q[1],q[0],q[2];", "mycswap q[1],q[0],q[2];"),
+        ("rxx(0.4) q[0],q[2];", "myrxx(0.4) q[0],q[2];"),
+        ("rzz(0.9) q[1],q[2];", "myrzz(0.9) q[1],q[2];"),
+        ("sx q[1];", "mysx q[1];"),
+        ("sx q[1]; sxdg q[1];", "id q[1];"),
+    ],
+)
+def test_qelib1_gates_match_their_definitions(gate, definition):
+    assert read(gate).equivalent(read(definition))
+
+
+def test_written_gates_read_back():
+    circuit = read("cu3(0.3,0.5,0.7) q[2],q[0]; rxx(0.4) q[0],q[2]; sx q[1]; sxdg q[0]; rzz(0.2) q[1],q[0];")
+    text = io.StringIO()
+    circuit.to_qasm(text)
+    text.seek(0)
+    assert np.allclose(QuantumCircuit.from_qasm(text).unitary(), circuit.unitary())
+
+
+@pytest.mark.parametrize(
+    "program, message",
+    [
+        ("rx(0.1) q[5];", "out of range"),
+        ("cx q[0], r[1];", "Undeclared"),
+        ("opaque foo a;", "Opaque"),
+        ("gate g a { h b; } g q[0];", "definition of g"),
+    ],
+)
+def test_invalid_programs_are_rejected_while_reading(program, message):
+    with pytest.raises(ValueError, match=message):
+        read(program)
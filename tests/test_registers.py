@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from qsm import QuantumCircuit, Qubit, StabilizerTableau
+
+
+def test_run_leaves_an_adopted_initial_state_to_its_owner():
+    buffer = np.zeros(4, dtype=np.complex128)
+    buffer[3] = 1
+    circuit = QuantumCircuit(2, lazy=True, backend="statevector")
+    circuit.x(0)
+    circuit.run(initial_state=Qubit.from_amplitudes(buffer))
+    assert np.allclose(buffer, [0, 0, 1, 0])
+    circuit.run()
+    assert np.allclose(buffer, [0, 0, 1, 0])
+    assert np.allclose(circuit.state_vector(), [0, 1, 0, 0])
+
+
+def test_eager_circuits_keep_a_writable_state_vector():
+    circuit = QuantumCircuit(2)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    assert isinstance(circuit.qubits, Qubit)
+    circuit.qubits.state[:] = [0, 1, 0, 0]
+    assert np.allclose(circuit.state_vector(), [0, 1, 0, 0])
+
+
+def test_tableau_state_is_read_only():
+    circuit = QuantumCircuit(2, lazy=True)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.run()
+    assert isinstance(circuit.qubits, StabilizerTableau)
+    with pytest.raises(ValueError):
+        circuit.qubits.state[:] = 0
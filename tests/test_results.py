@@ -0,0 +1,10 @@
+from qsm import Counts
+
+
+def test_membership_follows_the_observed_outcomes():
+    counts = Counts([1, 3], [5, 2], 2)
+    assert "01" in counts and 3 in counts
+    assert "00" not in counts and 0 not in counts
+    assert "000" not in counts and "x1" not in counts
+    assert counts["00"] == 0 and counts.get("00") == 0
+    assert list(counts.keys()) == ["01", "11"] and len(counts) == 2